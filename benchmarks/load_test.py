@@ -0,0 +1,392 @@
+"""Нагрузочный прогон бота на имитации тысяч игроков.
+
+Настоящие обработчики (start_game, admins_solve, change_role, notification)
+работают с фейковым Bot и временной SQLite-БД, которая подменяет функции
+database.commands / database.timers_deadline. Основная БД не затрагивается.
+
+Запуск из корня проекта:
+    python -m benchmarks.load_test --players 2000 --out bench.json
+
+Результат (JSON) содержит p50/p99 задержки обработчиков, число запросов к БД
+на одно обновление и скорость отправки сообщений, поэтому его можно сравнивать
+между коммитами.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+import database.commands
+import database.timers_deadline
+
+EXECUTOR = "Исполнитель"
+INSPECTOR = "Проверяющий"
+JUDGE = "Судья"
+ADMIN = "Админ"
+
+_SCHEMA = """
+CREATE TABLE users (
+    id INTEGER PRIMARY KEY, username TEXT, last_name TEXT, first_name TEXT,
+    middle_name TEXT, phone TEXT, role TEXT, started INTEGER DEFAULT 0,
+    created TEXT, overdue INTEGER DEFAULT 0, in_game INTEGER DEFAULT 0
+);
+CREATE TABLE games (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, executor INTEGER, inspector INTEGER,
+    judge INTEGER, admin INTEGER, ts TEXT, with_error TEXT, without_error TEXT,
+    all_errors TEXT, count_errors TEXT
+);
+CREATE TABLE args (id INTEGER PRIMARY KEY AUTOINCREMENT, game_id INTEGER, executor TEXT, inspector TEXT);
+CREATE TABLE stats_task (game_id INTEGER, wins_exe INTEGER, wins_ins INTEGER, overdue_role TEXT);
+CREATE TABLE overdue_count (user_id INTEGER PRIMARY KEY, count INTEGER);
+CREATE TABLE timer_deadline (user_id INTEGER, role TEXT, deadline_time TEXT, stage TEXT);
+CREATE TABLE timer_values (name TEXT PRIMARY KEY, value INTEGER);
+INSERT INTO timer_values VALUES ('TZ', 24), ('Default', 24);
+"""
+
+
+class TempDatabase:
+    """Временная SQLite-БД с тем же API, что и database.commands / timers_deadline"""
+
+    def __init__(self, path: str) -> None:
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(_SCHEMA)
+
+    def _one(self, sql: str, params: tuple = ()):
+        return self.connection.execute(sql, params).fetchone()
+
+    def _write(self, sql: str, params: tuple = ()) -> None:
+        with self.connection:
+            self.connection.execute(sql, params)
+
+    def add_users(self, role: str, user_ids: range) -> None:
+        with self.connection:
+            self.connection.executemany(
+                "INSERT INTO users (id, username, last_name, first_name, middle_name, role) "
+                "VALUES (?, ?, 'Фамилия', ?, 'Отчество', ?)",
+                [(user_id, f"user{user_id}", f"Игрок{user_id}", role) for user_id in user_ids],
+            )
+
+    # database.commands
+    async def get_users_by_id(self, user_id):
+        return self._one("SELECT * FROM users WHERE id = ?", (user_id,))
+
+    async def get_user_role(self, user_id):
+        row = self._one("SELECT role FROM users WHERE id = ?", (user_id,))
+        return row[0] if row else None
+
+    async def find_free_user(self, role):
+        row = self._one(
+            "SELECT id FROM users WHERE role = ? AND in_game = 0 ORDER BY random() LIMIT 1", (role,)
+        )
+        return row[0] if row else None
+
+    async def change_in_game(self, user_id, in_game):
+        self._write("UPDATE users SET in_game = ? WHERE id = ?", (in_game, user_id))
+
+    async def change_role(self, user_id, role):
+        self._write("UPDATE users SET role = ? WHERE id = ?", (role, user_id))
+
+    async def add_jud(self, user_id):
+        pass
+
+    async def add_ins(self, user_id):
+        pass
+
+    async def insert_new_game(self, user_id, ts=None, with_error=None, without_error=None,
+                              all_errors=None, count_errors=None):
+        participants = []
+        for role in (INSPECTOR, JUDGE, ADMIN):
+            participant = await self.find_free_user(role)
+            if participant is None:
+                return False
+            participants.append(participant)
+        with self.connection:
+            cursor = self.connection.execute(
+                "INSERT INTO games (executor, inspector, judge, admin, ts, with_error, "
+                "without_error, all_errors, count_errors) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (user_id, *participants, ts, with_error, without_error, all_errors, count_errors),
+            )
+            self.connection.execute(
+                "UPDATE users SET in_game = 1 WHERE id IN (?, ?, ?)", (user_id, *participants[:2])
+            )
+        # id новой игры (истинное значение, как и прежний True)
+        return cursor.lastrowid
+
+    async def get_last_game(self):
+        return self._one("SELECT * FROM games ORDER BY id DESC LIMIT 1")
+
+    async def get_last_game_id_by_user_id(self, user_id):
+        row = self._one(
+            "SELECT max(id) FROM games WHERE ? IN (executor, inspector, judge)", (user_id,)
+        )
+        return row[0] if row else None
+
+    async def get_game_by_id(self, game_id):
+        return self._one("SELECT * FROM games WHERE id = ?", (game_id,))
+
+    async def update_role_in_game(self, game_id, role, user_id):
+        self._write(f"UPDATE games SET {role} = ? WHERE id = ?", (user_id, game_id))
+
+    async def get_arg(self, game_id):
+        return self._one("SELECT * FROM args WHERE game_id = ?", (game_id,)) or (0, game_id, "", "")
+
+    async def update_stats(self, game, wins_exe, wins_ins, overdue_role=None):
+        self._write("INSERT INTO stats_task VALUES (?, ?, ?, ?)", (game[0], wins_exe, wins_ins, overdue_role))
+
+    # database.timers_deadline
+    async def get_deadline_users(self):
+        return self.connection.execute("SELECT * FROM timer_deadline").fetchall()
+
+    async def insert_deadline_timer(self, user_id, role, time_delta, stage):
+        deadline_time = datetime.now() + timedelta(hours=time_delta)
+        self._write("INSERT INTO timer_deadline VALUES (?, ?, ?, ?)", (user_id, role, str(deadline_time), stage))
+
+    async def delete_deadline_timer(self, user_id):
+        self._write("DELETE FROM timer_deadline WHERE user_id = ?", (user_id,))
+
+    async def get_timer_value(self, name):
+        return self._one("SELECT value FROM timer_values WHERE name = ?", (name,))[0]
+
+    async def increment_overdue_count(self, user_id):
+        self._write(
+            "INSERT INTO overdue_count VALUES (?, 1) "
+            "ON CONFLICT(user_id) DO UPDATE SET count = count + 1",
+            (user_id,),
+        )
+
+
+class Metrics:
+    def __init__(self) -> None:
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.queries = 0
+        self.updates = 0
+
+    async def timed(self, name: str, handler, *args):
+        self.updates += 1
+        started = time.perf_counter()
+        await handler(*args)
+        self.latencies[name].append(time.perf_counter() - started)
+
+    def report(self) -> dict:
+        handlers = {}
+        for name, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            handlers[name] = {
+                "count": len(values),
+                "p50_ms": round(statistics.median(values) * 1000, 3),
+                "p99_ms": round(values[min(len(values) - 1, int(len(values) * 0.99))] * 1000, 3),
+            }
+        return {
+            "handlers": handlers,
+            "db_queries_per_update": round(self.queries / max(self.updates, 1), 2),
+        }
+
+
+# Функция для подмены функций БД во всех модулях, которые импортировали их по имени
+def install_database(temp_db: TempDatabase, metrics: Metrics) -> None:
+    for module in (database.commands, database.timers_deadline):
+        for name in dir(module):
+            original = getattr(module, name)
+            replacement = getattr(temp_db, name, None)
+            if replacement is None or not callable(original):
+                continue
+
+            async def counted(*args, _call=replacement, **kwargs):
+                metrics.queries += 1
+                return await _call(*args, **kwargs)
+
+            for loaded in list(sys.modules.values()):
+                namespace = getattr(loaded, "__dict__", {})
+                for attribute, value in list(namespace.items()):
+                    if value is original:
+                        setattr(loaded, attribute, counted)
+
+
+class FakeBot:
+    """Заглушка Telegram: отвечает с задержкой и запоминает время отправки"""
+
+    def __init__(self, latency: float) -> None:
+        self.id = 1
+        self.latency = latency
+        self.sent: list[float] = []
+        self._message_ids = itertools.count(1)
+
+    async def _reply(self, chat_id):
+        await asyncio.sleep(self.latency)
+        self.sent.append(time.perf_counter())
+        return SimpleNamespace(message_id=next(self._message_ids), chat=SimpleNamespace(id=chat_id))
+
+    async def send_message(self, chat_id, **kwargs):
+        return await self._reply(chat_id)
+
+    async def send_document(self, chat_id, **kwargs):
+        return await self._reply(chat_id)
+
+
+class FakeMessage:
+    def __init__(self, bot: FakeBot, chat_id: int, text: str = "") -> None:
+        self.bot = bot
+        self.chat = SimpleNamespace(id=chat_id)
+        self.from_user = SimpleNamespace(id=chat_id, first_name=f"игрок{chat_id}")
+        self.text = text
+
+    async def answer(self, **kwargs):
+        return await self.bot._reply(self.chat.id)
+
+    async def edit_text(self, **kwargs):
+        return await self.bot._reply(self.chat.id)
+
+
+class FakeCallback:
+    def __init__(self, bot: FakeBot, chat_id: int, data: str = "") -> None:
+        self.bot = bot
+        self.message = FakeMessage(bot, chat_id)
+        self.from_user = self.message.from_user
+        self.data = data
+
+    async def answer(self, *args, **kwargs):
+        pass
+
+
+def _state(storage: MemoryStorage, bot: FakeBot, user_id: int) -> FSMContext:
+    return FSMContext(storage=storage, key=StorageKey(bot_id=bot.id, chat_id=user_id, user_id=user_id))
+
+
+async def run(players: int, latency: float, concurrency: int) -> dict:
+    directory = tempfile.mkdtemp(prefix="bench-")
+    # Служебная локальная БД бота тоже временная
+    os.environ["LOCAL_DB_PATH"] = os.path.join(directory, "state.sqlite3")
+    # Модули, читающие БД игры напрямую (пул игроков, проверка таймеров, выгрузки),
+    # берут путь при импорте: до импорта обработчиков направляем их во временную БД
+    game_db_path = os.path.join(directory, "game.db")
+    os.environ["DB_PATH"] = game_db_path
+    import admins_solve
+    import change_role
+    import notification
+    import start_game
+    from outbound import get_outbound
+
+    metrics = Metrics()
+    temp_db = TempDatabase(game_db_path)
+    install_database(temp_db, metrics)
+    bot = FakeBot(latency)
+    start_game.bot = admins_solve.bot = bot
+    storage = MemoryStorage()
+    dp = SimpleNamespace(fsm=SimpleNamespace(storage=storage))
+
+    executors = range(1, players + 1)
+    temp_db.add_users(EXECUTOR, executors)
+    temp_db.add_users(INSPECTOR, range(100_001, 100_001 + players))
+    temp_db.add_users(JUDGE, range(200_001, 200_001 + players))
+    temp_db.add_users(ADMIN, range(300_001, 300_001 + max(players // 50, 1)))
+    limit = asyncio.Semaphore(concurrency)
+    started = time.perf_counter()
+
+    # Полный сценарий исполнителя: start_game -> ... -> get_count_errors -> решение админа
+    async def play(user_id: int) -> None:
+        async with limit:
+            state = _state(storage, bot, user_id)
+            await metrics.timed("start_game", start_game.start_game, FakeCallback(bot, user_id), state)
+            for name, handler in (
+                ("get_ts", start_game.get_ts),
+                ("get_report_with_error", start_game.get_report_with_error),
+                ("get_report_without_error", start_game.get_report_without_error),
+                ("get_all_errors", start_game.get_all_errors),
+                ("get_count_errors", start_game.get_count_errors),
+            ):
+                await metrics.timed(name, handler, FakeMessage(bot, user_id, "https://docs/1"), state)
+            game_id = await temp_db.get_last_game_id_by_user_id(user_id)
+            if game_id is None:
+                return
+            game = await temp_db.get_game_by_id(game_id)
+            solve = admins_solve.get_good_solve if user_id % 2 else admins_solve.get_bad_solve
+            await metrics.timed(solve.__name__, solve, FakeCallback(bot, game[4], f"solve-{game_id}"))
+
+    await asyncio.gather(*(play(user_id) for user_id in executors))
+
+    # Смена ролей админом
+    temp_db.add_users("", range(400_001, 400_001 + players // 10))
+
+    async def rename(user_id: int) -> None:
+        async with limit:
+            state = _state(storage, bot, 300_001)
+            await state.update_data(user_id=user_id)
+            await metrics.timed(
+                "changed_role", change_role.changed_role, FakeCallback(bot, 300_001, JUDGE), state
+            )
+
+    await asyncio.gather(*(rename(user_id) for user_id in range(400_001, 400_001 + players // 10)))
+
+    # Массовая просрочка: все таймеры проверяющих истекли
+    expired_at = str(datetime.now() - timedelta(minutes=1))
+    with temp_db.connection:
+        temp_db.connection.execute("UPDATE timer_deadline SET deadline_time = ?", (expired_at,))
+    expiry_started = time.perf_counter()
+    # Без пауз между пачками: замер должен сравниваться с прежними коммитами
+    expiry = asyncio.create_task(notification.check_deadlines(bot, dp, catch_up_pause=0))
+    # Ждём, пока все просроченные таймеры будут обработаны
+    while True:
+        await asyncio.sleep(0.05)
+        pending = temp_db._one(
+            "SELECT count(*) FROM timer_deadline WHERE deadline_time <= ?", (expired_at,)
+        )[0]
+        if not pending and not notification.user_locks._locks:
+            break
+    expiry_seconds = time.perf_counter() - expiry_started
+    expiry.cancel()
+    await get_outbound(bot).join()
+
+    result = metrics.report()
+    elapsed = time.perf_counter() - started
+    sent = sorted(bot.sent)
+    result.update(
+        {
+            "players": players,
+            "elapsed_s": round(elapsed, 3),
+            "expiry_s": round(expiry_seconds, 3),
+            "messages_sent": len(sent),
+            "messages_per_s": round(len(sent) / max(sent[-1] - sent[0], 1e-9), 2) if sent else 0,
+        }
+    )
+    return result
+
+
+def _commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--players", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.02, help="задержка фейкового Telegram, с")
+    parser.add_argument("--concurrency", type=int, default=200, help="одновременных игроков")
+    parser.add_argument("--out", help="файл для JSON-результата")
+    args = parser.parse_args()
+    result = asyncio.run(run(args.players, args.latency, args.concurrency))
+    result["commit"] = _commit()
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as out_file:
+            out_file.write(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Замер пропускной способности и задержек локальной БД бота (local_storage).
+
+Использует только execute / executemany / execute_batch / ensure_schema, которые
+есть и до пула соединений, поэтому один и тот же прогон можно сравнить между
+коммитами:
+    git checkout <коммит> && python -m benchmarks.local_storage_bench --out after.json
+
+Нагрузка похожа на служебные данные бота: много параллельных чтений по ключу
+(напоминания, версии настроек, аренда) вперемешку с короткими записями.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import tempfile
+import time
+from collections import defaultdict
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS bench_state (
+    key INTEGER PRIMARY KEY,
+    value TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+"""
+
+
+def _percentiles(values: list[float]) -> dict:
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "p50_ms": round(statistics.median(values) * 1000, 3),
+        "p99_ms": round(values[min(len(values) - 1, int(len(values) * 0.99))] * 1000, 3),
+    }
+
+
+async def run(operations: int, concurrency: int, write_ratio: float, keys: int) -> dict:
+    directory = tempfile.mkdtemp(prefix="bench-storage-")
+    # Путь читается при импорте модуля
+    os.environ["LOCAL_DB_PATH"] = os.path.join(directory, "state.sqlite3")
+    import local_storage
+
+    await local_storage.ensure_schema(_SCHEMA)
+    await local_storage.executemany(
+        "INSERT OR REPLACE INTO bench_state VALUES (?, ?, ?)",
+        [(key, f"value{key}", time.time()) for key in range(keys)],
+    )
+    latencies: dict[str, list[float]] = defaultdict(list)
+    generator = random.Random(1)
+    plan = [
+        ("write" if generator.random() < write_ratio else "read", generator.randrange(keys))
+        for _ in range(operations)
+    ]
+    limit = asyncio.Semaphore(concurrency)
+
+    async def operation(kind: str, key: int) -> None:
+        async with limit:
+            started = time.perf_counter()
+            if kind == "read":
+                await local_storage.execute("SELECT value FROM bench_state WHERE key = ?", (key,))
+            else:
+                await local_storage.execute_batch(
+                    [
+                        ("UPDATE bench_state SET value = ?, updated = ? WHERE key = ?", (f"v{key}", time.time(), key)),
+                        ("UPDATE bench_state SET updated = ? WHERE key = ?", (time.time(), (key + 1) % keys)),
+                    ]
+                )
+            latencies[kind].append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(operation(kind, key) for kind, key in plan))
+    elapsed = time.perf_counter() - started
+    return {
+        "operations": operations,
+        "concurrency": concurrency,
+        "write_ratio": write_ratio,
+        "elapsed_s": round(elapsed, 3),
+        "ops_per_s": round(operations / elapsed, 1),
+        "queries": {kind: _percentiles(values) for kind, values in sorted(latencies.items())},
+    }
+
+
+def _commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--operations", type=int, default=20_000)
+    parser.add_argument("--concurrency", type=int, default=64, help="одновременных запросов")
+    parser.add_argument("--write-ratio", type=float, default=0.2, help="доля записей")
+    parser.add_argument("--keys", type=int, default=10_000)
+    parser.add_argument("--out", help="файл для JSON-результата")
+    args = parser.parse_args()
+    result = asyncio.run(run(args.operations, args.concurrency, args.write_ratio, args.keys))
+    result["commit"] = _commit()
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as out_file:
+            out_file.write(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,30 @@
 import asyncio
+import logging
 from datetime import datetime, timedelta
-from aiogram import types
+from aiogram import Bot, types
 from aiogram.fsm.context import FSMContext
-from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
 from aiogram.types import Message, CallbackQuery
-from database.timers_deadline import (
-    insert_deadline_timer,
-    delete_deadline_timer,
-    get_timer_value,
-)
+from timer_config import get_timer_value
+from deadline_scheduler import insert_deadline_timer, delete_deadline_timer
 from lexicon.lexicon_ru import lexicon
 from states.admins import AdminsStates
 from keyboards.select_role import select_role_keyboard
 import database.commands as db
+import user_cache
 from states.game import GameStates
+from metrics import instrument
+from outbound import get_outbound
+
+ROLES = ("Судья", "Проверяющий", "Исполнитель", "исключить", "Админ")
+# Сколько ошибок массовой смены ролей показываем админу
+BULK_REPORT_ERRORS = 50
+# Сколько пользователей массовой смены ролей обрабатывается одновременно
+BULK_CONCURRENCY = 10
 
 
 # Функция для начала процесса смены роли
+@instrument
 async def changing_role(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
     await callback.message.edit_text(text=lexicon["changing_role"])
@@ -24,6 +32,7 @@ async def changing_role(callback: CallbackQuery, state: FSMContext):
 
 
 # Функция для обработки reply меню
+@instrument
 async def handle_change_role_reply(message: Message, state: FSMContext):
     # Отправляет сообщение о начале процесса смены роли и переводит бота в состояние ожидания ID пользователя
     await message.answer(text=lexicon["changing_role"])
@@ -31,6 +40,7 @@ async def handle_change_role_reply(message: Message, state: FSMContext):
 
 
 # Функция для выбора роли
+@instrument
 async def select_role(message: Message, state: FSMContext):
     try:
         user_id = int(message.text)
@@ -48,6 +58,7 @@ async def select_role(message: Message, state: FSMContext):
 
 
 # Функция для смены роли
+@instrument
 async def changed_role(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
     data = await state.get_data()
@@ -56,31 +67,10 @@ async def changed_role(callback: CallbackQuery, state: FSMContext):
         data["user_id"]
     )  # Получаем текущую роль пользователя
     user = await db.get_users_by_id(data["user_id"])
-    if (
-        clb_data in ["Судья", "Проверяющий", "Исполнитель", "исключить", "Админ"]
-        and user[10]
-    ):
-        await callback.message.edit_text(
-            text=lexicon[
-                (
-                    "err_user_in_game"
-                    if clb_data != "исключить"
-                    else "err_user_exclude_in_game"
-                )
-            ].format(data["user_id"])
-        )
-    elif user_role == clb_data and (
-        user_role in [None, ""]
-        and clb_data not in ["Админ", "Исполнитель", "Судья", "Проверяющий"]
-    ):  # Проверяем, совпадает ли новая роль с текущей
-        text = (
-            lexicon["role_exists"].format(data["user_id"], user_role)
-            if user_role
-            else lexicon["role_exists_exclude"].format(data["user_id"])
-        )
-        await callback.message.edit_text(text=text)
+    error = role_change_error(data["user_id"], user, user_role, clb_data)
+    if error:
+        await callback.message.edit_text(text=error)
     else:
-        await db.change_role(data["user_id"], clb_data)
         # Формируем текст сообщения в зависимости от значения clb_data (обычная смена роли или исключение)
         text = (
             lexicon["changed_role"]
@@ -90,54 +80,178 @@ async def changed_role(callback: CallbackQuery, state: FSMContext):
             else lexicon["exclude_role"].replace("{}", str(data["user_id"]))
         )
         await callback.message.edit_text(text=text)
-        if clb_data == "Судья":
-            await db.add_jud(data["user_id"])
-            await callback.bot.send_message(
-                chat_id=data["user_id"], text=lexicon["set_judge_role"]
-            )  # noqa
-        elif clb_data == "Проверяющий":
-            await db.add_ins(data["user_id"])
-            await callback.bot.send_message(
-                chat_id=data["user_id"], text=lexicon["set_inspector_role"]
-            )  # noqa
-        elif clb_data == "Исполнитель":
-            user = await db.get_users_by_id(data["user_id"])
-            time_delta = await get_timer_value("TZ")
-            deadline_time = datetime.now() + timedelta(hours=time_delta)
-            formatted_deadline_time = deadline_time.strftime("%d-%m-%Y %H:%M")
-            await callback.bot.send_message(
-                chat_id=data["user_id"],
-                text=lexicon["set_executor_role"].format(
-                    user[3], formatted_deadline_time
-                ),
-            )  # noqa
-            await asyncio.sleep(1)
-            # Исправлена отправка сообщения Исполнителю
-            await callback.bot.send_message(
-                user[0], text=lexicon["report_ts"].format(user[3])
-            )
-            await insert_deadline_timer(user[0], clb_data, time_delta, "tz")
-            # Исправлена установка состояния Исполнителю
-            # Создание ключа для пользователя
-            user_key = StorageKey(
-                user_id=user[0],
-                chat_id=user[0],
-                bot_id=callback.bot.id,
-                extra_param="error",
-            )
-            # Инициализация FSMContext с этим ключом
-            user_state = FSMContext(storage=state.storage, key=user_key)
-            await user_state.update_data()  # обновить дату для пользователя
-            # Установка состояния GameStates.TS для Исполнителя
-            await user_state.set_state(GameStates.TS)
-
-        # Добавляем обработку для исключения
-        elif clb_data == "исключить":
-            # Удаляем все таймеры, связанные с пользователем
-            await delete_deadline_timer(data["user_id"])
-            await db.change_role(data["user_id"], "")
-            await db.change_in_game(data["user_id"], 0)  # Убираем пользователя из игры
-            await callback.bot.send_message(
-                chat_id=data["user_id"], text=lexicon["exclude"]
-            )
+        await apply_role(callback.bot, state.storage, user, clb_data)
+        if clb_data == "исключить":
             await state.clear()
+
+
+# Функция для проверки, можно ли сменить роль: возвращает текст ошибки или None.
+# user и user_role должны быть прочитаны из БД, а не из кэша
+def role_change_error(user_id: int, user: tuple, user_role: str | None, new_role: str) -> str | None:
+    if new_role in ROLES and user[10]:
+        return lexicon[
+            "err_user_in_game" if new_role != "исключить" else "err_user_exclude_in_game"
+        ].format(user_id)
+    if user_role == new_role and (
+        user_role in [None, ""]
+        and new_role not in ["Админ", "Исполнитель", "Судья", "Проверяющий"]
+    ):  # Проверяем, совпадает ли новая роль с текущей
+        return (
+            lexicon["role_exists"].format(user_id, user_role)
+            if user_role
+            else lexicon["role_exists_exclude"].format(user_id)
+        )
+    return None
+
+
+# Функция для записи новой роли пользователю, его таймеров и уведомления
+async def apply_role(bot: Bot, storage: BaseStorage, user: tuple, role: str) -> None:
+    await user_cache.change_role(user[0], role)
+    await apply_role_effects(bot, storage, user, role)
+
+
+# Функция для всего, что следует за записью роли: таймеры, состояние и уведомление
+async def apply_role_effects(bot: Bot, storage: BaseStorage, user: tuple, role: str) -> None:
+    user_id = user[0]
+    outbound = get_outbound(bot)
+    if role == "Судья":
+        await user_cache.add_jud(user_id)
+        outbound.send_message(user_id, text=lexicon["set_judge_role"])
+    elif role == "Проверяющий":
+        await user_cache.add_ins(user_id)
+        outbound.send_message(user_id, text=lexicon["set_inspector_role"])
+    elif role == "Исполнитель":
+        time_delta = await get_timer_value("TZ")
+        deadline_time = datetime.now() + timedelta(hours=time_delta)
+        formatted_deadline_time = deadline_time.strftime("%d-%m-%Y %H:%M")
+        outbound.send_message(
+            user_id,
+            text=lexicon["set_executor_role"].format(user[3], formatted_deadline_time),
+        )
+        outbound.send_message(user_id, text=lexicon["report_ts"].format(user[3]))
+        await insert_deadline_timer(user_id, role, time_delta, "tz")
+        # Исполнителю сразу выставляем состояние ожидания ТЗ
+        user_key = StorageKey(
+            user_id=user_id,
+            chat_id=user_id,
+            bot_id=bot.id,
+            extra_param="error",
+        )
+        user_state = FSMContext(storage=storage, key=user_key)
+        await user_state.update_data()  # обновить дату для пользователя
+        await user_state.set_state(GameStates.TS)
+    elif role == "исключить":
+        # Удаляем все таймеры, связанные с пользователем
+        await delete_deadline_timer(user_id)
+        await user_cache.change_role(user_id, "")
+        await user_cache.change_in_game(user_id, 0)  # Убираем пользователя из игры
+        outbound.send_message(user_id, text=lexicon["exclude"])
+
+
+# Функция для разбора файла массовой смены ролей: строки вида "ID,роль"
+def parse_bulk_roles(text: str) -> tuple[dict[int, str], list[str]]:
+    assignments, errors = {}, []
+    for number, line in enumerate(text.splitlines(), start=1):
+        line = line.strip()
+        if not line:
+            continue
+        parts = [part.strip() for part in line.replace(";", ",").split(",", 1)]
+        if len(parts) != 2 or not parts[0].isdigit() or parts[1] not in ROLES:
+            errors.append(f"Строка {number}: не удалось разобрать «{line}»")
+            continue
+        user_id = int(parts[0])
+        if user_id in assignments:
+            errors.append(f"Строка {number}: ID {user_id} указан повторно")
+            continue
+        assignments[user_id] = parts[1]
+    return assignments, errors
+
+
+# Функция для проверки назначений теми же правилами, что и changed_role (по свежим данным БД)
+async def validate_bulk_roles(assignments: dict[int, str]) -> tuple[list[tuple], list[str]]:
+    users = await user_cache.read_users(assignments)
+    valid, errors = [], []
+    for user_id, role in assignments.items():
+        user = users.get(user_id)
+        if not user:
+            errors.append(f"ID {user_id}: пользователь не найден")
+            continue
+        error = role_change_error(user_id, user, user[6], role)
+        if error:
+            errors.append(error)
+        else:
+            valid.append((user, role))
+    return valid, errors
+
+
+# Функция для массовой смены ролей по загруженному файлу
+@instrument
+async def bulk_changed_role(message: Message, state: FSMContext):
+    if message.document is None:
+        await message.answer(text="Отправьте текстовый файл со строками «ID,роль» документом.")
+        return
+    try:
+        content = await message.bot.download(message.document)
+        text = content.read().decode("utf-8-sig")
+    except Exception as e:
+        # Ошибка скачивания из Telegram или файл не в UTF-8
+        logging.error(f"Error in bulk_changed_role: {e}")
+        await message.answer(text="Не удалось прочитать файл. Нужен текстовый файл со строками «ID,роль».")
+        return
+    assignments, errors = parse_bulk_roles(text)
+    try:
+        valid, invalid = await validate_bulk_roles(assignments)
+    except Exception as e:
+        logging.error(f"Error in bulk_changed_role: {e}")
+        await message.answer(text="Не удалось проверить пользователей, роли не изменены.")
+        return
+    errors += invalid
+    slots = asyncio.Semaphore(BULK_CONCURRENCY)
+
+    async def bounded(work):
+        async with slots:
+            return await work
+
+    # Сначала записываем только роли: если хоть одна запись не удалась, возвращаем
+    # прежние роли, чтобы файл не применился частично
+    written = await asyncio.gather(
+        *(bounded(user_cache.change_role(user[0], role)) for user, role in valid),
+        return_exceptions=True,
+    )
+    failed = [(user, result) for (user, _), result in zip(valid, written) if isinstance(result, Exception)]
+    if failed:
+        for user, result in failed:
+            logging.error(f"Error in bulk_changed_role: {result}")
+        restored = await asyncio.gather(
+            *(
+                bounded(user_cache.change_role(user[0], user[6]))
+                for (user, _), result in zip(valid, written)
+                if not isinstance(result, Exception)
+            ),
+            return_exceptions=True,
+        )
+        for result in restored:
+            if isinstance(result, Exception):
+                logging.error(f"Error in bulk_changed_role: {result}")
+        await message.answer(
+            text=f"Роли не изменены: не удалось записать роль для {len(failed)} пользователей, "
+            "уже записанные роли возвращены."
+        )
+        return
+    results = await asyncio.gather(
+        *(bounded(apply_role_effects(message.bot, state.storage, user, role)) for user, role in valid),
+        return_exceptions=True,
+    )
+    applied = 0
+    for (user, role), result in zip(valid, results):
+        if isinstance(result, Exception):
+            logging.error(f"Error in bulk_changed_role: {result}")
+            errors.append(f"ID {user[0]}: ошибка при смене роли")
+        else:
+            applied += 1
+    report = f"Роли изменены: {applied} из {len(assignments)}."
+    if errors:
+        report += "\n\n" + "\n".join(errors[:BULK_REPORT_ERRORS])
+        if len(errors) > BULK_REPORT_ERRORS:
+            report += f"\n… и ещё {len(errors) - BULK_REPORT_ERRORS}"
+    await message.answer(text=report)
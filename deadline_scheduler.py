@@ -0,0 +1,334 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import sqlite3
+import time
+from datetime import datetime
+from typing import Callable, NamedTuple
+
+from database.timers_deadline import (
+    get_deadline_users,
+    insert_deadline_timer as db_insert_deadline_timer,
+    delete_deadline_timer as db_delete_deadline_timer,
+)
+from exporter import DB_PATH
+from game_journal import TIMER_CLEARED, TIMER_SET, journal
+from leases import shard_leases
+from reminder_store import sent_reminders
+
+# Виды событий таймера дедлайна
+REMINDER_2H = "2h"
+REMINDER_1H = "1h"
+EXPIRED = "expired"
+
+HOUR = 3600
+# Расхождение дедлайна в БД и в планировщике, при котором это тот же таймер
+DEADLINE_TOLERANCE = 60
+# Как часто (секунды) сверяем планировщик с таблицей таймеров: её меняют и
+# обработчики, которые вызывают database.timers_deadline напрямую
+RESYNC_INTERVAL = 300
+
+
+class DeadlineEvent(NamedTuple):
+    # deadline_time хранится как epoch (секунды), чтобы сравнения были дешёвыми
+    user_id: int
+    role: str
+    deadline_time: float
+    stage: str
+    kind: str
+    token: int
+
+
+class DeadlineScheduler:
+    """Очередь событий дедлайнов на min-heap: спит до ближайшего события"""
+
+    def __init__(self, owns: Callable[[int], bool] = lambda user_id: True) -> None:
+        # Несколько воркеров: событие обрабатывает только владелец шарда пользователя
+        self.owns = owns
+        self._heap: list[tuple[float, int, DeadlineEvent]] = []
+        self._seq = itertools.count()
+        # user_id -> {токен: (epoch дедлайна, роль, этап)} активных таймеров
+        self._timers: dict[int, dict[int, tuple[float, str, str]]] = {}
+        # user_id -> epoch выдачи задания (известно только для таймеров, созданных этим процессом)
+        self._issued: dict[int, float] = {}
+        self._stale = 0
+        # Наступившие события чужих шардов ждут, пока шард не перейдёт к нам
+        self._deferred: list[tuple[float, int, DeadlineEvent]] = []
+        # Номер последнего изменения таймеров пользователя: сверка с БД их не трогает
+        self._changes = 0
+        self._changed: dict[int, int] = {}
+        self._wakeup = asyncio.Event()
+
+    def __len__(self) -> int:
+        return sum(len(tokens) for tokens in self._timers.values())
+
+    # Функция для добавления таймера и его событий (2ч, 1ч, просрочка)
+    def schedule(
+        self, user_id: int, role: str, deadline_time: float, stage: str, issued_at: float = None
+    ) -> None:
+        token = next(self._seq)
+        self._touch(user_id)
+        if issued_at is not None:
+            self._issued[user_id] = issued_at
+        self._timers.setdefault(user_id, {})[token] = (deadline_time, role, stage)
+        for kind, fire_at in (
+            (REMINDER_2H, deadline_time - HOUR * 2),
+            (REMINDER_1H, deadline_time - HOUR),
+            (EXPIRED, deadline_time),
+        ):
+            event = DeadlineEvent(user_id, role, deadline_time, stage, kind, token)
+            heapq.heappush(self._heap, (fire_at, next(self._seq), event))
+        self._wakeup.set()
+
+    # Функция для отмены всех таймеров пользователя
+    def cancel(self, user_id: int) -> None:
+        tokens = self._timers.pop(user_id, None)
+        self._issued.pop(user_id, None)
+        self._touch(user_id)
+        if not tokens:
+            return
+        # Записи в куче удаляются лениво, но куча не должна разрастаться
+        self._stale += 3 * len(tokens)
+        if self._stale > len(self._heap) // 2:
+            self._compact()
+        self._wakeup.set()
+
+    # Функция для получения таймеров с дедлайном раньше cutoff (по возрастанию)
+    def due_before(self, cutoff: float) -> list[tuple[int, str, float, str]]:
+        due = [
+            (user_id, role, deadline_time, stage)
+            for user_id, timers in self._timers.items()
+            for deadline_time, role, stage in timers.values()
+            if deadline_time < cutoff
+        ]
+        due.sort(key=lambda timer: timer[2])
+        return due
+
+    # Функция для возврата в очередь отложенных событий шардов, полученных воркером
+    def resume_deferred(self) -> None:
+        deferred, self._deferred = self._deferred, []
+        for entry in deferred:
+            if not self._is_live(entry[2]):
+                continue
+            if self.owns(entry[2].user_id):
+                heapq.heappush(self._heap, entry)
+            else:
+                self._deferred.append(entry)
+        self._wakeup.set()
+
+    def clear(self) -> None:
+        self._heap.clear()
+        self._deferred.clear()
+        self._timers.clear()
+        self._issued.clear()
+        self._changed.clear()
+        self._stale = 0
+        self._wakeup.set()
+
+    @property
+    def changes(self) -> int:
+        return self._changes
+
+    # Функция для сверки с таймерами из БД {user_id: [(epoch, роль, этап)]}, прочитанными
+    # после изменения номер mark. Возвращает пользователей, у которых таймеров не осталось
+    def sync(self, stored: dict[int, list[tuple[float, str, str]]], mark: int, now: float) -> list[int]:
+        removed = []
+        for user_id in set(self._timers) | set(stored):
+            # Изменён уже после чтения БД: снимок для него устарел
+            if self._changed.get(user_id, 0) > mark:
+                continue
+            # Наступившие таймеры уже обрабатываются (или их разберёт catch-up)
+            timers = [timer for timer in stored.get(user_id, ()) if timer[0] > now]
+            if _same_timers(timers, [timer for timer in self.timers(user_id) if timer[0] > now]):
+                continue
+            self.cancel(user_id)
+            for deadline_time, role, stage in timers:
+                self.schedule(user_id, role, deadline_time, stage)
+            if not timers:
+                removed.append(user_id)
+        self._changed = {user_id: change for user_id, change in self._changed.items() if change > mark}
+        return removed
+
+    def issued_at(self, user_id: int) -> float | None:
+        return self._issued.get(user_id)
+
+    def timers(self, user_id: int) -> list[tuple[float, str, str]]:
+        return list(self._timers.get(user_id, {}).values())
+
+    def _touch(self, user_id: int) -> None:
+        self._changes += 1
+        self._changed[user_id] = self._changes
+
+    def _is_live(self, event: DeadlineEvent) -> bool:
+        return event.token in self._timers.get(event.user_id, ())
+
+    def _compact(self) -> None:
+        self._heap = [entry for entry in self._heap if self._is_live(entry[2])]
+        heapq.heapify(self._heap)
+        self._stale = 0
+
+    def _pop(self) -> DeadlineEvent:
+        _, _, event = heapq.heappop(self._heap)
+        if event.kind == EXPIRED:
+            tokens = self._timers.get(event.user_id)
+            if tokens is not None:
+                tokens.pop(event.token, None)
+                if not tokens:
+                    del self._timers[event.user_id]
+        return event
+
+    # Функция ожидания ближайшего актуального события
+    async def next_due(self) -> DeadlineEvent:
+        while True:
+            while self._heap and not self._is_live(self._heap[0][2]):
+                heapq.heappop(self._heap)
+                self._stale = max(self._stale - 1, 0)
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+            delay = self._heap[0][0] - time.time()
+            if delay <= 0:
+                if not self.owns(self._heap[0][2].user_id):
+                    self._deferred.append(heapq.heappop(self._heap))
+                    continue
+                event = self._pop()
+                if _is_current(event, time.time()):
+                    return event
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+
+# Напоминание актуально, только пока не наступило окно следующего события
+def _is_current(event: DeadlineEvent, now: float) -> bool:
+    if event.kind == REMINDER_2H:
+        return now < event.deadline_time - HOUR
+    if event.kind == REMINDER_1H:
+        return now < event.deadline_time
+    return True
+
+
+def _same_timers(first: list[tuple[float, str, str]], second: list[tuple[float, str, str]]) -> bool:
+    if len(first) != len(second):
+        return False
+    return all(
+        a[1:] == b[1:] and abs(a[0] - b[0]) <= DEADLINE_TOLERANCE
+        for a, b in zip(sorted(first), sorted(second))
+    )
+
+
+scheduler = DeadlineScheduler(owns=shard_leases.owns)
+
+# Имя колонки user_id таблицы таймеров (первая колонка) для каждой БД
+_timer_key: dict[str, str] = {}
+
+
+# Функция для чтения таймеров пользователя из БД игры (только чтение): [(epoch, роль, этап)]
+def _read_timers(db_path: str, user_id: int) -> list[tuple[float, str, str]]:
+    connection = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        if db_path not in _timer_key:
+            _timer_key[db_path] = connection.execute("PRAGMA table_info(timer_deadline)").fetchone()[1]
+        rows = connection.execute(
+            f'SELECT * FROM timer_deadline WHERE "{_timer_key[db_path]}" = ?', (user_id,)
+        ).fetchall()
+    finally:
+        connection.close()
+    return [(to_epoch(deadline_time), role, stage) for _, role, deadline_time, stage in rows]
+
+
+# Функция для проверки, что таймер ещё есть в БД: обработчики вне этого модуля
+# удаляют таймеры напрямую, и событие в куче могло остаться от удалённого таймера
+async def timer_exists(user_id: int, role: str, deadline_time: float, stage: str, db_path: str = DB_PATH) -> bool:
+    try:
+        stored = await asyncio.to_thread(_read_timers, db_path, user_id)
+    except Exception as e:
+        logging.error(f"Error in timer_exists: {e}")
+        # Проверить не удалось: обрабатываем событие, чтобы не потерять просрочку
+        return True
+    return any(_same_timers([timer], [(deadline_time, role, stage)]) for timer in stored)
+
+
+# Функция для получения дедлайна в том виде, в каком его записала БД: после
+# перезапуска таймер читается оттуда, и ключи напоминаний должны совпасть
+async def _stored_deadline(user_id: int, role: str, stage: str, default: float, db_path: str = DB_PATH) -> float:
+    try:
+        stored = await asyncio.to_thread(_read_timers, db_path, user_id)
+    except Exception as e:
+        logging.error(f"Error in _stored_deadline: {e}")
+        return default
+    deadlines = [deadline_time for deadline_time, timer_role, timer_stage in stored
+                 if timer_role == role and timer_stage == stage]
+    return max(deadlines, default=default)
+
+
+# Функция для добавления таймера дедлайна в БД и в планировщик
+async def insert_deadline_timer(user_id: int, role: str, time_delta: int, stage: str) -> None:
+    issued_at = time.time()
+    await db_insert_deadline_timer(user_id, role, time_delta, stage)
+    deadline_time = await _stored_deadline(user_id, role, stage, time.time() + time_delta * HOUR)
+    scheduler.schedule(user_id, role, deadline_time, stage, issued_at)
+    await shard_leases.publish("schedule", user_id, role, deadline_time, stage)
+    journal.record(TIMER_SET, user_id=user_id, role=role, deadline=deadline_time, stage=stage)
+
+
+# Функция для удаления таймеров дедлайна из БД и из планировщика
+async def delete_deadline_timer(user_id: int) -> None:
+    await db_delete_deadline_timer(user_id)
+    scheduler.cancel(user_id)
+    await sent_reminders.discard_user(user_id)
+    await shard_leases.publish("cancel", user_id)
+    journal.record(TIMER_CLEARED, user_id=user_id)
+
+
+# Функция для применения изменения таймера, сделанного другим воркером
+def apply_remote_change(op: str, user_id: int, role: str, deadline_time: float, stage: str) -> None:
+    if op == "schedule":
+        # Таймер мог уже попасть в планировщик при загрузке из БД
+        if (deadline_time, role, stage) in scheduler.timers(user_id):
+            return
+        scheduler.schedule(user_id, role, deadline_time, stage)
+    elif op == "cancel":
+        scheduler.cancel(user_id)
+
+
+# Функция для сверки планировщика с таблицей таймеров БД
+async def resync_deadlines() -> None:
+    mark = scheduler.changes
+    stored = {}
+    for user_id, role, deadline_time, stage in await get_deadline_users():
+        stored.setdefault(user_id, []).append((to_epoch(deadline_time), role, stage))
+    for user_id in scheduler.sync(stored, mark, time.time()):
+        await sent_reminders.discard_user(user_id)
+
+
+# Функция для периодической сверки планировщика с БД (в фоне)
+async def maintain_deadlines(interval: float = RESYNC_INTERVAL) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await resync_deadlines()
+        except Exception as e:
+            logging.error(f"Error in maintain_deadlines: {e}")
+
+
+# Функция для загрузки всех таймеров из БД (при старте)
+async def load_deadlines() -> None:
+    await sent_reminders.load()
+    scheduler.clear()
+    for user_id, role, deadline_time, stage in await get_deadline_users():
+        scheduler.schedule(user_id, role, to_epoch(deadline_time), stage)
+
+
+# Функция для приведения дедлайна из БД к epoch: datetime, число или ISO-строка
+def to_epoch(deadline_time: datetime | float | str) -> float:
+    if isinstance(deadline_time, (int, float)):
+        return float(deadline_time)
+    if isinstance(deadline_time, str):
+        # fromisoformat реализован на C и заметно быстрее strptime
+        deadline_time = datetime.fromisoformat(deadline_time)
+    return deadline_time.timestamp()
@@ -0,0 +1,303 @@
+import asyncio
+import csv
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import struct
+import uuid
+import zipfile
+
+try:
+    from openpyxl import Workbook
+except ImportError:  # без openpyxl выгружаем только CSV
+    Workbook = None
+
+# Путь к основной БД игры (читается только на чтение)
+DB_PATH = os.getenv("DB_PATH", "./database/database.db")
+
+# Сколько строк читаем из таблицы за один раз
+CHUNK_SIZE = 1000
+
+USERS_TABLES = ["users"]
+ALL_TABLES = [
+    "games",
+    "args",
+    "stats_task",
+    "stats_judge",
+    "stats_inspector",
+    "stats_executor",
+    "stats_player",
+    "overdue_count",
+    "timer_deadline",
+    "timer_values",
+]
+
+# Таблицы, в которые в основном только добавляют строки: дописываем новые по rowid
+APPEND_TABLES = {"games", "timer_deadline"}
+
+# Версии выгруженных таблиц, чтобы не выгружать неизменённые заново
+MANIFEST_NAME = "manifest.json"
+
+# Счётчики изменений таблиц ведут триггеры в БД игры: их видно и для записей в
+# обход бота. token меняется при пересоздании счётчиков (например, БД заменили)
+_VERSIONS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS export_versions (
+    name TEXT PRIMARY KEY,
+    inserts INTEGER NOT NULL DEFAULT 0,
+    changes INTEGER NOT NULL DEFAULT 0,
+    token TEXT NOT NULL
+)
+"""
+
+# (путь к БД, таблица), для которых триггеры уже созданы этим процессом
+_versioned: set[tuple[str, str]] = set()
+
+
+# Две выгрузки одновременно писали бы в одни и те же файлы
+_export_lock = asyncio.Lock()
+
+
+def _connect_readonly(db_path: str) -> sqlite3.Connection:
+    return sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+
+
+def _table_paths(table: str, directory: str) -> list[str]:
+    paths = [os.path.join(directory, f"{table}.csv")]
+    if Workbook is not None:
+        paths.append(os.path.join(directory, f"{table}.xlsx"))
+    return paths
+
+
+# Функция для потоковой выгрузки таблицы в CSV и XLSX (память не зависит от размера).
+# Если задан after_rowid, в CSV дописываются только строки с большим rowid.
+def export_table(
+    connection: sqlite3.Connection, table: str, directory: str, after_rowid: int | None = None
+) -> list[str]:
+    paths = _table_paths(table, directory)
+    if after_rowid is None:
+        cursor = connection.execute(f'SELECT * FROM "{table}"')
+    else:
+        cursor = connection.execute(
+            f'SELECT * FROM "{table}" WHERE rowid > ? ORDER BY rowid', (after_rowid,)
+        )
+    header = [column[0] for column in cursor.description]
+    with open(paths[0], "w" if after_rowid is None else "a", newline="", encoding="utf-8") as csv_file:
+        writer = csv.writer(csv_file)
+        if after_rowid is None:
+            writer.writerow(header)
+        while rows := cursor.fetchmany(CHUNK_SIZE):
+            writer.writerows(rows)
+    if Workbook is not None:
+        # XLSX нельзя дописать, поэтому лист пересобирается целиком
+        _export_xlsx(connection, table, paths[1])
+    return paths
+
+
+def _export_xlsx(connection: sqlite3.Connection, table: str, xlsx_path: str) -> None:
+    cursor = connection.execute(f'SELECT * FROM "{table}"')
+    # write_only режим openpyxl пишет строки на диск, не держа лист в памяти
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(table)
+    sheet.append([column[0] for column in cursor.description])
+    while rows := cursor.fetchmany(CHUNK_SIZE):
+        for row in rows:
+            sheet.append(row)
+    workbook.save(xlsx_path)
+
+
+# Функция для хеша строк таблицы по порядку rowid (до up_to_rowid включительно, если задан)
+def _table_digest(connection: sqlite3.Connection, table: str, up_to_rowid: int | None = None) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    if up_to_rowid is None:
+        cursor = connection.execute(f'SELECT * FROM "{table}" ORDER BY rowid')
+    else:
+        cursor = connection.execute(
+            f'SELECT * FROM "{table}" WHERE rowid <= ? ORDER BY rowid', (up_to_rowid,)
+        )
+    while rows := cursor.fetchmany(CHUNK_SIZE):
+        digest.update(repr(rows).encode())
+    return digest.hexdigest()
+
+
+# Функция для создания счётчиков изменений и триггеров в БД игры (один раз на таблицу)
+def _install_versions(db_path: str, tables: list[str]) -> None:
+    missing = [table for table in tables if (db_path, table) not in _versioned]
+    if not missing:
+        return
+    connection = sqlite3.connect(db_path)
+    try:
+        connection.execute(_VERSIONS_SCHEMA)
+        for table in missing:
+            try:
+                with connection:
+                    connection.execute(
+                        "INSERT OR IGNORE INTO export_versions (name, token) VALUES (?, ?)",
+                        (table, uuid.uuid4().hex),
+                    )
+                    for event, column in (("INSERT", "inserts"), ("UPDATE", "changes"), ("DELETE", "changes")):
+                        connection.execute(
+                            f'CREATE TRIGGER IF NOT EXISTS "export_versions_{table}_{event.lower()}" '
+                            f'AFTER {event} ON "{table}" BEGIN '
+                            f"UPDATE export_versions SET {column} = {column} + 1 WHERE name = '{table}'; END"
+                        )
+            except sqlite3.Error as e:
+                # Для таблицы без триггеров изменения определяются по хешу строк
+                logging.error(f"Error in _install_versions: {e}")
+                continue
+            _versioned.add((db_path, table))
+    finally:
+        connection.close()
+
+
+def _read_versions(connection: sqlite3.Connection) -> dict[str, tuple]:
+    try:
+        rows = connection.execute("SELECT name, inserts, changes, token FROM export_versions").fetchall()
+    except sqlite3.OperationalError:
+        return {}
+    return {name: (inserts, changes, token) for name, inserts, changes, token in rows}
+
+
+# Функция для получения версии таблицы. Со счётчиками триггеров: (token, вставки,
+# изменения, максимальный rowid) без чтения строк; без них: (число строк, rowid, хеш)
+def _table_version(connection: sqlite3.Connection, table: str, versions: dict[str, tuple]) -> dict:
+    max_rowid = connection.execute(f'SELECT coalesce(max(rowid), 0) FROM "{table}"').fetchone()[0]
+    if table in versions:
+        inserts, changes, token = versions[table]
+        return {"token": token, "inserts": inserts, "changes": changes, "max_rowid": max_rowid}
+    count = connection.execute(f'SELECT count(*) FROM "{table}"').fetchone()[0]
+    # Строки меняются на месте и в «дописываемых» таблицах (например, судья в games)
+    return {"count": count, "max_rowid": max_rowid, "digest": _table_digest(connection, table)}
+
+
+# Функция для проверки, что с прошлой выгрузки в таблицу только добавлялись строки
+def _only_appended(connection: sqlite3.Connection, table: str, previous: dict, version: dict) -> bool:
+    if version["max_rowid"] < previous["max_rowid"]:
+        return False
+    if "token" in version:
+        return previous.get("token") == version["token"] and previous.get("changes") == version["changes"]
+    # Счётчиков нет: сверяем число строк и хеш прежней части таблицы
+    appended = connection.execute(
+        f'SELECT count(*) FROM "{table}" WHERE rowid > ?', (previous["max_rowid"],)
+    ).fetchone()[0]
+    return previous.get("count", -1) + appended == version["count"] and previous.get(
+        "digest"
+    ) == _table_digest(connection, table, previous["max_rowid"])
+
+
+# Функция для выгрузки только изменившихся таблиц; возвращает True, если что-то изменилось
+def _export_changed(
+    connection: sqlite3.Connection, table: str, directory: str, manifest: dict, versions: dict[str, tuple]
+) -> bool:
+    version = _table_version(connection, table, versions)
+    previous = manifest.get(table)
+    files_exist = all(os.path.exists(path) for path in _table_paths(table, directory))
+    if previous == version and files_exist:
+        return False
+    after_rowid = None
+    if (
+        table in APPEND_TABLES
+        and previous is not None
+        and files_exist
+        and _only_appended(connection, table, previous, version)
+    ):
+        after_rowid = previous["max_rowid"]
+    export_table(connection, table, directory, after_rowid)
+    manifest[table] = version
+    return True
+
+
+# Функция для копирования сжатого файла из прежнего архива без повторного сжатия
+def _copy_member(source: zipfile.ZipFile, info: zipfile.ZipInfo, archive: zipfile.ZipFile) -> None:
+    source.fp.seek(info.header_offset)
+    header = source.fp.read(zipfile.sizeFileHeader)
+    fields = struct.unpack(zipfile.structFileHeader, header)
+    # Поля 10 и 11 локального заголовка: длины имени файла и extra
+    header += source.fp.read(fields[10] + fields[11])
+    info.header_offset = archive.fp.tell()
+    archive.fp.write(header)
+    remaining = info.compress_size
+    while remaining:
+        chunk = source.fp.read(min(remaining, 1 << 20))
+        archive.fp.write(chunk)
+        remaining -= len(chunk)
+    archive.filelist.append(info)
+    archive.NameToInfo[info.filename] = info
+    archive.start_dir = archive.fp.tell()
+
+
+# Функция для сборки архива: заново сжимаются только файлы изменившихся таблиц
+def _write_archive(archive_path: str, paths: list[str], changed: set[str]) -> None:
+    try:
+        previous = zipfile.ZipFile(archive_path)
+    except (OSError, zipfile.BadZipFile):
+        previous = None
+    temp_path = archive_path + ".tmp"
+    try:
+        with zipfile.ZipFile(temp_path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+            for path in paths:
+                name = os.path.basename(path)
+                info = previous.NameToInfo.get(name) if previous is not None else None
+                if (
+                    info is not None
+                    and path not in changed
+                    and info.file_size == os.path.getsize(path)
+                    # Файлы с дескриптором данных после сжатых данных не переносим
+                    and not info.flag_bits & 0x08
+                ):
+                    _copy_member(previous, info, archive)
+                else:
+                    archive.write(path, arcname=name)
+    finally:
+        if previous is not None:
+            previous.close()
+    os.replace(temp_path, archive_path)
+
+
+def _export_archive(db_path: str, tables: list[str], directory: str, archive_name: str) -> str:
+    os.makedirs(directory, exist_ok=True)
+    manifest_path = os.path.join(directory, MANIFEST_NAME)
+    try:
+        with open(manifest_path, encoding="utf-8") as manifest_file:
+            manifest = json.load(manifest_file)
+    except (OSError, ValueError):
+        manifest = {}
+    try:
+        _install_versions(db_path, tables)
+    except sqlite3.Error as e:
+        # БД недоступна на запись: изменения определяются по хешу строк
+        logging.error(f"Error in _export_archive: {e}")
+    connection = _connect_readonly(db_path)
+    try:
+        versions = _read_versions(connection)
+        changed = {
+            path
+            for table in tables
+            if _export_changed(connection, table, directory, manifest, versions)
+            for path in _table_paths(table, directory)
+        }
+    finally:
+        connection.close()
+    archive_path = os.path.join(directory, archive_name)
+    if changed or not os.path.exists(archive_path):
+        paths = [path for table in tables for path in _table_paths(table, directory)]
+        _write_archive(archive_path, paths, changed)
+        with open(manifest_path, "w", encoding="utf-8") as manifest_file:
+            json.dump(manifest, manifest_file)
+    return archive_path
+
+
+# Функция для выгрузки таблиц в один архив в отдельном потоке (не блокирует бота).
+# send вызывается с путём архива под той же блокировкой: пока архив хешируется и
+# загружается, другая выгрузка его не перезапишет.
+async def export_tables(
+    tables: list[str], directory: str, archive_name: str, db_path: str = DB_PATH, send=None
+) -> str:
+    async with _export_lock:
+        archive_path = await asyncio.to_thread(
+            _export_archive, db_path, tables, directory, archive_name
+        )
+        if send is not None:
+            await send(archive_path)
+        return archive_path
@@ -0,0 +1,81 @@
+import asyncio
+import hashlib
+import logging
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile
+
+import local_storage
+from outbound import get_outbound
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS file_ids (
+    digest TEXT PRIMARY KEY,
+    file_id TEXT NOT NULL
+);
+"""
+
+
+def _digest(path: str, filename: str) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    # Имя файла видно получателю, поэтому оно тоже часть ключа
+    return f"{digest.hexdigest()}:{filename}"
+
+
+class FileIdCache:
+    """Хэш содержимого файла -> file_id Telegram: одинаковый файл не загружается повторно"""
+
+    def __init__(self) -> None:
+        self._ids: dict[str, str] = {}
+        self._loaded = False
+
+    async def _load(self) -> None:
+        if self._loaded:
+            return
+        await local_storage.ensure_schema(_SCHEMA)
+        self._ids = dict(await local_storage.execute("SELECT digest, file_id FROM file_ids"))
+        self._loaded = True
+
+    async def get(self, digest: str) -> str | None:
+        await self._load()
+        return self._ids.get(digest)
+
+    async def put(self, digest: str, file_id: str) -> None:
+        await self._load()
+        self._ids[digest] = file_id
+        await local_storage.execute(
+            "INSERT INTO file_ids VALUES (?, ?) "
+            "ON CONFLICT(digest) DO UPDATE SET file_id = excluded.file_id",
+            (digest, file_id),
+        )
+
+    async def discard(self, digest: str) -> None:
+        await self._load()
+        if self._ids.pop(digest, None) is not None:
+            await local_storage.execute("DELETE FROM file_ids WHERE digest = ?", (digest,))
+
+
+file_ids = FileIdCache()
+
+
+# Функция для отправки файла: по file_id, если такой файл уже загружался, иначе загрузкой
+async def send_document(bot: Bot, chat_id: int, path: str, filename: str):
+    outbound = get_outbound(bot)
+    digest = await asyncio.to_thread(_digest, path, filename)
+    file_id = await file_ids.get(digest)
+    if file_id is not None:
+        try:
+            return await outbound.send_document(chat_id, document=file_id)
+        except TelegramBadRequest as e:
+            # Устаревший file_id: загружаем файл заново
+            logging.error(f"Error in send_document: {e}")
+            await file_ids.discard(digest)
+    message = await outbound.send_document(chat_id, document=FSInputFile(path, filename=filename))
+    document = getattr(message, "document", None)
+    if document is not None:
+        await file_ids.put(digest, document.file_id)
+    return message
@@ -0,0 +1,166 @@
+import asyncio
+import json
+import logging
+from collections import OrderedDict
+from typing import Any
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+import local_storage
+
+# Сколько ключей держим в памяти и через сколько секунд сбрасываем изменения на диск
+HOT_CACHE_SIZE = 10_000
+FLUSH_DELAY = 0.05
+FLUSH_RETRY_DELAY = 1.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS fsm (
+    key TEXT PRIMARY KEY,
+    state TEXT,
+    data TEXT NOT NULL
+);
+"""
+
+
+def _key(key: StorageKey) -> str:
+    return ":".join(
+        str(part)
+        for part in (
+            key.bot_id,
+            key.chat_id,
+            key.user_id,
+            getattr(key, "thread_id", None),
+            getattr(key, "business_connection_id", None),
+            key.destiny,
+        )
+    )
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM-хранилище в локальной SQLite-БД: переживает перезапуск бота.
+
+    Изменения состояния и данных за одно обновление сливаются в одну запись,
+    в памяти держится ограниченный кэш последних пользователей.
+    """
+
+    def __init__(self, hot_cache_size: int = HOT_CACHE_SIZE, flush_delay: float = FLUSH_DELAY) -> None:
+        self._hot_cache_size = hot_cache_size
+        self._flush_delay = flush_delay
+        # key -> [state, data]
+        self._cache: OrderedDict[str, list] = OrderedDict()
+        self._dirty: set[str] = set()
+        self._flush_handle: asyncio.TimerHandle | None = None
+        self._flushing: asyncio.Task | None = None
+        self._ready = False
+
+    async def _entry(self, key: StorageKey) -> list:
+        storage_key = _key(key)
+        entry = self._cache.get(storage_key)
+        if entry is None:
+            if not self._ready:
+                await local_storage.ensure_schema(_SCHEMA)
+                self._ready = True
+            rows = await local_storage.execute(
+                "SELECT state, data FROM fsm WHERE key = ?", (storage_key,)
+            )
+            entry = self._cache.get(storage_key)
+            if entry is None:
+                entry = [rows[0][0], json.loads(rows[0][1])] if rows else [None, {}]
+                self._cache[storage_key] = entry
+        self._cache.move_to_end(storage_key)
+        self._evict()
+        return entry
+
+    def _evict(self) -> None:
+        # Вытесняем самые старые ключи; ещё не записанные на диск переносим в конец.
+        # Последний ключ используется сейчас: до него очередь не доходит
+        attempts = len(self._cache) - 1
+        while len(self._cache) > self._hot_cache_size and attempts > 0:
+            attempts -= 1
+            storage_key, entry = self._cache.popitem(last=False)
+            if storage_key in self._dirty:
+                self._cache[storage_key] = entry
+
+    def _mark_dirty(self, key: StorageKey) -> None:
+        self._dirty.add(_key(key))
+        self._schedule_flush()
+
+    def _schedule_flush(self, delay: float | None = None) -> None:
+        if self._flush_handle is None:
+            loop = asyncio.get_running_loop()
+            self._flush_handle = loop.call_later(
+                self._flush_delay if delay is None else delay, self._start_flush
+            )
+
+    def _start_flush(self) -> None:
+        self._flush_handle = None
+        self._flushing = asyncio.create_task(self.flush())
+
+    # Функция для записи накопленных изменений одной транзакцией
+    async def flush(self) -> None:
+        dirty, self._dirty = self._dirty, set()
+        upserts, deletes = [], []
+        for storage_key in dirty:
+            state, data = self._cache[storage_key]
+            if state is None and not data:
+                deletes.append((storage_key,))
+            else:
+                upserts.append((storage_key, state, json.dumps(data, ensure_ascii=False)))
+        try:
+            if not self._ready:
+                await local_storage.ensure_schema(_SCHEMA)
+                self._ready = True
+            if upserts:
+                await local_storage.executemany(
+                    "INSERT INTO fsm VALUES (?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data",
+                    upserts,
+                )
+            if deletes:
+                await local_storage.executemany("DELETE FROM fsm WHERE key = ?", deletes)
+        except Exception as e:
+            # Изменения не потеряны: ключи снова помечены и будут записаны следующим сбросом
+            logging.error(f"Error in SQLiteStorage flush: {e}")
+            self._dirty |= dirty
+            self._schedule_flush(FLUSH_RETRY_DELAY)
+            return
+        self._evict()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        entry = await self._entry(key)
+        entry[0] = state.state if isinstance(state, State) else state
+        self._mark_dirty(key)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        return (await self._entry(key))[0]
+
+    async def set_data(self, key: StorageKey, data: dict[str, Any]) -> None:
+        entry = await self._entry(key)
+        entry[1] = data.copy()
+        self._mark_dirty(key)
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        return (await self._entry(key))[1].copy()
+
+    # Функция для очистки состояния сразу многих пользователей одним запросом
+    async def clear_many(self, keys: list[StorageKey]) -> None:
+        storage_keys = [_key(key) for key in keys]
+        for storage_key in storage_keys:
+            self._cache[storage_key] = [None, {}]
+            self._dirty.discard(storage_key)
+        if not self._ready:
+            await local_storage.ensure_schema(_SCHEMA)
+            self._ready = True
+        await local_storage.executemany(
+            "DELETE FROM fsm WHERE key = ?", [(storage_key,) for storage_key in storage_keys]
+        )
+        self._evict()
+
+    async def close(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._flushing is not None:
+            await self._flushing
+        await self.flush()
@@ -0,0 +1,130 @@
+import asyncio
+import json
+import logging
+import time
+
+import local_storage
+
+# Записи, пришедшие за COMMIT_DELAY, фиксируются одной транзакцией
+COMMIT_DELAY = 0.005
+MAX_BATCH = 500
+
+# Виды переходов
+GAME_SUBMITTED = "game_submitted"
+SOLVE_APPROVED = "solve_approved"
+ROLE_ASSIGNED = "role_assigned"
+IN_GAME = "in_game"
+TIMER_SET = "timer_set"
+TIMER_CLEARED = "timer_cleared"
+OVERDUE = "overdue"
+GAME_FINISHED = "game_finished"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS game_journal (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts REAL NOT NULL,
+    event TEXT NOT NULL,
+    game_id INTEGER,
+    user_id INTEGER,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS game_journal_game ON game_journal (game_id, seq);
+"""
+
+
+class GameJournal:
+    """Журнал аудита переходов игры: только дозапись, с групповой фиксацией.
+
+    Сами изменения игры по-прежнему пишутся в БД игры по одному; журнал лишь
+    фиксирует, какие переходы сделал бот, и восстановить по нему состояние
+    нельзя (переходы в обход обёрток в него не попадают).
+
+    record() сразу возвращает Future, который завершается после фиксации
+    записи на диске. Обёртки записи в БД его не ждут: журнал вторичен, и
+    его сбой (например, занятая БД) только логируется, не прерывая игру.
+    """
+
+    def __init__(self, commit_delay: float = COMMIT_DELAY, max_batch: int = MAX_BATCH) -> None:
+        self._commit_delay = commit_delay
+        self._max_batch = max_batch
+        # (строка для вставки, future)
+        self._pending: list[tuple[tuple, asyncio.Future]] = []
+        self._commit_handle: asyncio.TimerHandle | None = None
+        self._committing: asyncio.Task | None = None
+        self._ready = False
+
+    def record(self, event: str, game_id: int = None, user_id: int = None, **data) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        future.add_done_callback(_log_failure)
+        row = (time.time(), event, game_id, user_id, json.dumps(data, ensure_ascii=False, default=str))
+        self._pending.append((row, future))
+        if len(self._pending) >= self._max_batch:
+            self._start_commit()
+        elif self._commit_handle is None and self._committing is None:
+            self._commit_handle = loop.call_later(self._commit_delay, self._start_commit)
+        return future
+
+    def _start_commit(self) -> None:
+        if self._commit_handle is not None:
+            self._commit_handle.cancel()
+            self._commit_handle = None
+        if self._committing is None:
+            self._committing = asyncio.create_task(self._commit())
+
+    async def _commit(self) -> None:
+        try:
+            while self._pending:
+                batch, self._pending = self._pending[: self._max_batch], self._pending[self._max_batch:]
+                try:
+                    if not self._ready:
+                        await local_storage.ensure_schema(_SCHEMA)
+                        self._ready = True
+                    await local_storage.executemany(
+                        "INSERT INTO game_journal (ts, event, game_id, user_id, data) VALUES (?, ?, ?, ?, ?)",
+                        [row for row, _ in batch],
+                    )
+                except Exception as e:
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                for _, future in batch:
+                    if not future.done():
+                        future.set_result(None)
+        finally:
+            self._committing = None
+
+    # Функция ожидания фиксации всех записанных переходов
+    async def flush(self) -> None:
+        if self._pending:
+            self._start_commit()
+        if self._committing is not None:
+            await asyncio.shield(self._committing)
+
+    # Функция для чтения журнала по порядку (всего или одной игры) для разбора инцидентов
+    async def entries(self, game_id: int = None, after_seq: int = 0) -> list[tuple]:
+        await self.flush()
+        if not self._ready:
+            await local_storage.ensure_schema(_SCHEMA)
+            self._ready = True
+        if game_id is None:
+            rows = await local_storage.execute(
+                "SELECT seq, ts, event, game_id, user_id, data FROM game_journal WHERE seq > ? ORDER BY seq",
+                (after_seq,),
+            )
+        else:
+            rows = await local_storage.execute(
+                "SELECT seq, ts, event, game_id, user_id, data FROM game_journal "
+                "WHERE game_id = ? AND seq > ? ORDER BY seq",
+                (game_id, after_seq),
+            )
+        return [(seq, ts, event, game, user, json.loads(data)) for seq, ts, event, game, user, data in rows]
+
+
+def _log_failure(future: asyncio.Future) -> None:
+    if not future.cancelled() and future.exception() is not None:
+        logging.error(f"Error in game_journal: {future.exception()}")
+
+
+journal = GameJournal()
@@ -0,0 +1,17 @@
+import asyncio
+import weakref
+from typing import Hashable
+
+
+class KeyedLocks:
+    """Блокировки по ключу (пользователь, игра); неиспользуемые удаляются сами"""
+
+    def __init__(self) -> None:
+        self._locks: weakref.WeakValueDictionary = weakref.WeakValueDictionary()
+
+    def __call__(self, key: Hashable) -> asyncio.Lock:
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[key] = lock
+        return lock
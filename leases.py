@@ -0,0 +1,192 @@
+import asyncio
+import logging
+import math
+import os
+import socket
+import time
+
+import local_storage
+
+# Таймеры делятся на шарды по user_id, каждым шардом владеет один воркер
+SHARDS = int(os.getenv("DEADLINE_SHARDS", "16"))
+LEASE_TTL = 30
+RENEW_INTERVAL = 10
+# Как часто воркер читает изменения таймеров, сделанные другими воркерами
+FEED_INTERVAL = 1
+FEED_RETENTION = 3600
+
+# Включить, если check_deadlines запущен в нескольких процессах
+USE_LEASES = os.getenv("DEADLINE_LEASES") == "1"
+WORKER_ID = os.getenv("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS deadline_leases (
+    shard INTEGER PRIMARY KEY,
+    owner TEXT,
+    expires REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS deadline_workers (
+    worker_id TEXT PRIMARY KEY,
+    expires REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS deadline_feed (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    created REAL NOT NULL,
+    origin TEXT NOT NULL,
+    op TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    role TEXT,
+    deadline REAL,
+    stage TEXT
+);
+"""
+
+
+class ShardLeases:
+    """Аренда шардов таймеров с истечением: упавший воркер теряет свои шарды через LEASE_TTL"""
+
+    def __init__(self, worker_id: str = WORKER_ID, shards: int = SHARDS, ttl: float = LEASE_TTL) -> None:
+        self.worker_id = worker_id
+        self.shards = shards
+        self.ttl = ttl
+        self.owned: set[int] = set()
+        # До этого момента (epoch) аренда owned действительна и в БД: после него
+        # шарды мог забрать другой воркер, даже если продление ещё не вернуло ошибку
+        self.owned_until = 0.0
+        self.enabled = False
+        self._feed_seq = 0
+
+    def shard_of(self, user_id: int) -> int:
+        return user_id % self.shards
+
+    def owns(self, user_id: int) -> bool:
+        if not self.enabled:
+            return True
+        return time.time() < self.owned_until and self.shard_of(user_id) in self.owned
+
+    async def start(self) -> None:
+        await local_storage.ensure_schema(_SCHEMA)
+        await local_storage.executemany(
+            "INSERT OR IGNORE INTO deadline_leases VALUES (?, NULL, 0)",
+            [(shard,) for shard in range(self.shards)],
+        )
+        rows = await local_storage.execute("SELECT coalesce(max(seq), 0) FROM deadline_feed")
+        self._feed_seq = rows[0][0]
+        self.enabled = True
+
+    # Функция для продления своих шардов и захвата свободных (не больше своей доли)
+    async def renew(self) -> set[int]:
+        now = time.time()
+        expires = now + self.ttl
+        # Аренда успела истечь: события шардов откладывались, их нужно вернуть
+        lapsed = now >= self.owned_until
+        try:
+            owned = await self._renew(now, expires)
+        except BaseException:
+            # Не знаем, продлена ли аренда: считаем, что шардов у нас нет
+            self.owned = set()
+            self.owned_until = 0.0
+            raise
+        acquired = set(owned) if lapsed else owned - self.owned
+        self.owned = owned
+        self.owned_until = expires
+        return acquired
+
+    async def _renew(self, now: float, expires: float) -> set[int]:
+        # Одна транзакция: два воркера не могут захватить один шард
+        async with local_storage.unit_of_work() as uow:
+            await uow.execute(
+                "INSERT INTO deadline_workers VALUES (?, ?) "
+                "ON CONFLICT(worker_id) DO UPDATE SET expires = excluded.expires",
+                (self.worker_id, expires),
+            )
+            await uow.execute(
+                "UPDATE deadline_leases SET expires = ? WHERE owner = ? AND expires >= ?",
+                (expires, self.worker_id, now),
+            )
+            rows = await uow.execute(
+                "SELECT count(*) FROM deadline_workers WHERE expires >= ?", (now,)
+            )
+            fair_share = math.ceil(self.shards / max(rows[0][0], 1))
+            owned = await self._owned(uow, now)
+            if len(owned) > fair_share:
+                # Отдаём лишние шарды новым воркерам
+                extra = sorted(owned)[fair_share:]
+                await uow.executemany(
+                    "UPDATE deadline_leases SET owner = NULL, expires = 0 WHERE shard = ? AND owner = ?",
+                    [(shard, self.worker_id) for shard in extra],
+                )
+                owned -= set(extra)
+            elif len(owned) < fair_share:
+                await uow.execute(
+                    "UPDATE deadline_leases SET owner = ?, expires = ? WHERE shard IN ("
+                    "SELECT shard FROM deadline_leases WHERE expires < ? ORDER BY shard LIMIT ?)",
+                    (self.worker_id, expires, now, fair_share - len(owned)),
+                )
+                owned = await self._owned(uow, now)
+        return owned
+
+    async def _owned(self, uow: local_storage.UnitOfWork, now: float) -> set[int]:
+        rows = await uow.execute(
+            "SELECT shard FROM deadline_leases WHERE owner = ? AND expires >= ?",
+            (self.worker_id, now),
+        )
+        return {shard for (shard,) in rows}
+
+    async def release(self) -> None:
+        await local_storage.execute(
+            "UPDATE deadline_leases SET owner = NULL, expires = 0 WHERE owner = ?", (self.worker_id,)
+        )
+        await local_storage.execute(
+            "DELETE FROM deadline_workers WHERE worker_id = ?", (self.worker_id,)
+        )
+        self.owned = set()
+        self.owned_until = 0.0
+
+    # Функция для публикации изменения таймера другим воркерам
+    async def publish(self, op: str, user_id: int, role: str = None, deadline: float = None, stage: str = None) -> None:
+        if not self.enabled:
+            return
+        await local_storage.execute(
+            "INSERT INTO deadline_feed (created, origin, op, user_id, role, deadline, stage) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (time.time(), self.worker_id, op, user_id, role, deadline, stage),
+        )
+
+    # Функция для чтения изменений таймеров, сделанных другими воркерами
+    async def poll(self) -> list[tuple]:
+        rows = await local_storage.execute(
+            "SELECT seq, op, user_id, role, deadline, stage FROM deadline_feed "
+            "WHERE seq > ? AND origin != ? ORDER BY seq",
+            (self._feed_seq, self.worker_id),
+        )
+        if rows:
+            self._feed_seq = rows[-1][0]
+        return [row[1:] for row in rows]
+
+    async def trim_feed(self) -> None:
+        await local_storage.execute(
+            "DELETE FROM deadline_feed WHERE created < ?", (time.time() - FEED_RETENTION,)
+        )
+
+
+shard_leases = ShardLeases()
+
+
+# Функция для фонового продления аренды и применения изменений других воркеров
+async def maintain_leases(on_change, on_acquired) -> None:
+    last_renew = 0.0
+    while True:
+        try:
+            for change in await shard_leases.poll():
+                on_change(*change)
+            if time.monotonic() - last_renew >= RENEW_INTERVAL:
+                # Неудачное продление повторяем на следующем шаге, а не через RENEW_INTERVAL
+                acquired = await shard_leases.renew()
+                last_renew = time.monotonic()
+                if acquired:
+                    on_acquired()
+                await shard_leases.trim_feed()
+        except Exception as e:
+            logging.error(f"Error in maintain_leases: {e}")
+        await asyncio.sleep(FEED_INTERVAL)
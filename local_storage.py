@@ -0,0 +1,141 @@
+import asyncio
+import os
+import sqlite3
+from contextlib import asynccontextmanager
+
+# Локальная БД бота для служебных данных (не путать с основной БД игры)
+LOCAL_DB_PATH = os.getenv("LOCAL_DB_PATH", "./data/bot_state.sqlite3")
+
+# Соединений только на чтение: в режиме WAL они не ждут пишущее соединение
+READ_POOL_SIZE = 4
+# Сколько подготовленных запросов кэширует каждое соединение
+CACHED_STATEMENTS = 256
+BUSY_TIMEOUT_MS = 5000
+
+_writer: sqlite3.Connection | None = None
+_write_lock = asyncio.Lock()
+_readers: asyncio.Queue | None = None
+
+
+def _open() -> sqlite3.Connection:
+    directory = os.path.dirname(LOCAL_DB_PATH)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # isolation_level=None: транзакции открываем сами (BEGIN IMMEDIATE в unit_of_work)
+    connection = sqlite3.connect(
+        LOCAL_DB_PATH,
+        check_same_thread=False,
+        isolation_level=None,
+        cached_statements=CACHED_STATEMENTS,
+    )
+    connection.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    connection.execute("PRAGMA journal_mode = WAL")
+    connection.execute("PRAGMA synchronous = NORMAL")
+    return connection
+
+
+def _writer_connection() -> sqlite3.Connection:
+    global _writer
+    if _writer is None:
+        _writer = _open()
+    return _writer
+
+
+def _reader_pool() -> asyncio.Queue:
+    global _readers
+    if _readers is None:
+        _readers = asyncio.Queue()
+        for _ in range(READ_POOL_SIZE):
+            _readers.put_nowait(None)  # соединение открывается при первом использовании
+    return _readers
+
+
+def _is_read(sql: str) -> bool:
+    return sql.lstrip()[:6].upper() in ("SELECT", "WITH")
+
+
+def _fetch(connection: sqlite3.Connection, sql: str, params: tuple) -> list:
+    return connection.execute(sql, params).fetchall()
+
+
+def _in_transaction(connection: sqlite3.Connection, work, *args):
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        result = work(connection, *args)
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+    connection.execute("COMMIT")
+    return result
+
+
+def _run_many(connection: sqlite3.Connection, sql: str, params: list) -> None:
+    connection.executemany(sql, params)
+
+
+def _run_batch(connection: sqlite3.Connection, statements: list[tuple[str, tuple]]) -> None:
+    for sql, params in statements:
+        connection.execute(sql, params)
+
+
+# Функция для выполнения запроса к локальной БД вне event loop
+async def execute(sql: str, params: tuple = ()) -> list:
+    if _is_read(sql):
+        readers = _reader_pool()
+        connection = await readers.get()
+        try:
+            if connection is None:
+                connection = await asyncio.to_thread(_open)
+            return await asyncio.to_thread(_fetch, connection, sql, params)
+        finally:
+            readers.put_nowait(connection)
+    async with _write_lock:
+        return await asyncio.to_thread(_fetch, _writer_connection(), sql, params)
+
+
+# Функция для пакетного выполнения запроса к локальной БД
+async def executemany(sql: str, params: list) -> None:
+    async with _write_lock:
+        await asyncio.to_thread(_in_transaction, _writer_connection(), _run_many, sql, params)
+
+
+# Функция для выполнения нескольких запросов одной транзакцией
+async def execute_batch(statements: list[tuple[str, tuple]]) -> None:
+    async with _write_lock:
+        await asyncio.to_thread(_in_transaction, _writer_connection(), _run_batch, statements)
+
+
+# Функция для создания таблиц (CREATE TABLE IF NOT EXISTS ...)
+async def ensure_schema(script: str) -> None:
+    async with _write_lock:
+        await asyncio.to_thread(_writer_connection().executescript, script)
+
+
+class UnitOfWork:
+    """Запросы внутри unit_of_work идут через одно соединение и одну транзакцию"""
+
+    def __init__(self, connection: sqlite3.Connection) -> None:
+        self._connection = connection
+
+    async def execute(self, sql: str, params: tuple = ()) -> list:
+        return await asyncio.to_thread(_fetch, self._connection, sql, params)
+
+    async def executemany(self, sql: str, params: list) -> None:
+        await asyncio.to_thread(_run_many, self._connection, sql, params)
+
+
+# Функция для группировки нескольких запросов в одну транзакцию:
+#     async with local_storage.unit_of_work() as uow:
+#         await uow.execute(...)
+# Внутри блока нельзя вызывать пишущие функции модуля: они ждут то же соединение
+@asynccontextmanager
+async def unit_of_work():
+    async with _write_lock:
+        connection = _writer_connection()
+        await asyncio.to_thread(connection.execute, "BEGIN IMMEDIATE")
+        try:
+            yield UnitOfWork(connection)
+        except BaseException:
+            await asyncio.to_thread(connection.execute, "ROLLBACK")
+            raise
+        await asyncio.to_thread(connection.execute, "COMMIT")
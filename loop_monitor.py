@@ -0,0 +1,90 @@
+import asyncio
+import cProfile
+import io
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import traceback
+
+from metrics import Counter, register
+
+# Сколько (секунды) колбэк может занимать event loop до предупреждения
+STALL_THRESHOLD = float(os.getenv("LOOP_STALL_THRESHOLD", "0.1"))
+HEARTBEAT_INTERVAL = 0.05
+
+loop_stalls = register(Counter("bot_loop_stalls_total", "Блокировки event loop дольше порога"))
+
+
+class LoopWatchdog:
+    """Отдельный поток следит за «пульсом» event loop и снимает стек при зависании"""
+
+    def __init__(self, threshold: float = STALL_THRESHOLD) -> None:
+        self.threshold = threshold
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._loop_thread_id = 0
+        self._heartbeat = time.monotonic()
+        self._stopped = threading.Event()
+
+    def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._beat()
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def _beat(self) -> None:
+        self._heartbeat = time.monotonic()
+        if not self._stopped.is_set():
+            self._loop.call_later(HEARTBEAT_INTERVAL, self._beat)
+
+    def _watch(self) -> None:
+        reported = None
+        while not self._stopped.wait(HEARTBEAT_INTERVAL):
+            heartbeat = self._heartbeat
+            stalled = time.monotonic() - heartbeat
+            if stalled < self.threshold + HEARTBEAT_INTERVAL or reported == heartbeat:
+                continue
+            # Одно предупреждение на одну блокировку
+            reported = heartbeat
+            loop_stalls.inc()
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else ""
+            task = asyncio.current_task(self._loop)
+            where = task.get_coro().__qualname__ if task else "callback"
+            logging.warning(f"Event loop blocked for {stalled:.3f}s in {where}\n{stack}")
+
+
+# Функция для включения детектора блокировок event loop
+def start_loop_monitor(threshold: float = STALL_THRESHOLD, debug: bool = False) -> LoopWatchdog:
+    if debug:
+        # asyncio сам залогирует медленные колбэки с указанием обработчика
+        loop = asyncio.get_running_loop()
+        loop.set_debug(True)
+        loop.slow_callback_duration = threshold
+    watchdog = LoopWatchdog(threshold)
+    watchdog.start()
+    return watchdog
+
+
+_profile_lock = asyncio.Lock()
+
+
+# Функция для профилирования event loop в течение окна: возвращает отчёт pstats
+async def profile_loop(seconds: float, limit: int = 40) -> str:
+    async with _profile_lock:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.disable()
+    report = io.StringIO()
+    stats = pstats.Stats(profiler, stream=report)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(limit)
+    stats.sort_stats(pstats.SortKey.TIME).print_stats(limit)
+    return report.getvalue()
@@ -0,0 +1,195 @@
+import asyncio
+import bisect
+import functools
+import inspect
+import logging
+import sys
+import time
+from collections import defaultdict
+from typing import Callable
+
+from outbound import queue_depth
+
+# Границы корзин гистограмм задержек (секунды)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9102
+
+
+def _labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str) -> None:
+        self.name = name
+        self.help = help_text
+        self._values: dict[tuple, float] = defaultdict(float)
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        self._values[tuple(sorted(labels.items()))] += amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_labels(key)} {value}" for key, value in self._values.items()]
+        return lines
+
+
+class Gauge:
+    """Значение читается функцией в момент выгрузки метрик"""
+
+    def __init__(
+        self, name: str, help_text: str, read: Callable[[], float], metric_type: str = "gauge"
+    ) -> None:
+        self.name = name
+        self.help = help_text
+        self.read = read
+        # "counter" для счётчиков, которые ведёт сам объект (например, попадания в кэш)
+        self.metric_type = metric_type
+
+    def render(self) -> list[str]:
+        return [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} {self.metric_type}",
+            f"{self.name} {self.read()}",
+        ]
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets: tuple = LATENCY_BUCKETS) -> None:
+        self.name = name
+        self.help = help_text
+        self.buckets = buckets
+        # метки -> [счётчики по корзинам..., сумма, количество]
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        entry = self._values.get(key)
+        if entry is None:
+            entry = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            entry[index] += 1
+        entry[-2] += value
+        entry[-1] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, entry in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, entry):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(key + (('le', bound),))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_labels(key + (('le', '+Inf'),))} {entry[-1]}")
+            lines.append(f"{self.name}_sum{_labels(key)} {entry[-2]}")
+            lines.append(f"{self.name}_count{_labels(key)} {entry[-1]}")
+        return lines
+
+
+REGISTRY: list = []
+
+
+def register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+
+handler_latency = register(Histogram("bot_handler_latency_seconds", "Время работы обработчика"))
+handler_errors = register(Counter("bot_handler_errors_total", "Ошибки в обработчиках (logging.error)"))
+db_latency = register(Histogram("bot_db_query_latency_seconds", "Время запроса к БД"))
+db_errors = register(Counter("bot_db_query_errors_total", "Исключения в запросах к БД"))
+deadline_lag = register(Histogram("bot_deadline_lag_seconds", "Насколько позже срока сработало событие дедлайна"))
+deadline_event_latency = register(Histogram("bot_deadline_event_seconds", "Время обработки события дедлайна"))
+register(Gauge("bot_outbound_queue_depth", "Сообщений в очереди на отправку", queue_depth))
+
+
+# Декоратор для замера времени обработчика aiogram
+def instrument(handler):
+    @functools.wraps(handler)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await handler(*args, **kwargs)
+        except Exception:
+            handler_errors.inc(handler=handler.__name__)
+            raise
+        finally:
+            handler_latency.observe(time.perf_counter() - started, handler=handler.__name__)
+
+    return wrapper
+
+
+def _instrument_query(function, module_name: str):
+    @functools.wraps(function)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await function(*args, **kwargs)
+        except Exception:
+            db_errors.inc(query=function.__name__)
+            raise
+        finally:
+            db_latency.observe(time.perf_counter() - started, module=module_name, query=function.__name__)
+
+    return wrapper
+
+
+# Функция для подмены функций БД на замеряемые (в том числе импортированных по имени)
+def instrument_database(*modules) -> None:
+    replacements = {}
+    for module in modules:
+        for name, function in vars(module).items():
+            if inspect.iscoroutinefunction(function) and function.__module__ == module.__name__:
+                replacements[id(function)] = (function, _instrument_query(function, module.__name__))
+    for loaded in list(sys.modules.values()):
+        namespace = getattr(loaded, "__dict__", {})
+        for attribute, value in list(namespace.items()):
+            replacement = replacements.get(id(value))
+            if replacement is not None and replacement[0] is value:
+                setattr(loaded, attribute, replacement[1])
+
+
+class _ErrorCounter(logging.Handler):
+    """Считает logging.error по функции, из которой он вызван"""
+
+    def __init__(self) -> None:
+        super().__init__(level=logging.ERROR)
+
+    def emit(self, record: logging.LogRecord) -> None:
+        handler_errors.inc(handler=record.funcName)
+
+
+def render() -> str:
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+
+async def _serve(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        await reader.readuntil(b"\r\n\r\n")
+        body = render().encode()
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            + f"Content-Length: {len(body)}\r\n".encode()
+            + b"Connection: close\r\n\r\n"
+            + body
+        )
+        await writer.drain()
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+# Функция для запуска локального HTTP-эндпоинта с метриками в формате Prometheus
+async def start_metrics_server(host: str = METRICS_HOST, port: int = METRICS_PORT) -> asyncio.Server:
+    import database.commands
+    import database.timers_deadline
+
+    instrument_database(database.commands, database.timers_deadline)
+    logging.getLogger().addHandler(_ErrorCounter())
+    return await asyncio.start_server(_serve, host, port)
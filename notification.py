@@ -1,26 +1,47 @@
 import asyncio
+import logging
+import os
+import time
 from aiogram import Bot, Dispatcher
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.storage.base import StorageKey
 from datetime import datetime, timedelta
 from database.commands import (
-    get_users_by_id,
-    find_free_user,
-    change_in_game,
     get_last_game_id_by_user_id,
     get_game_by_id,
-    update_role_in_game,
-    get_arg,
-    update_stats,
 )
-from database.timers_deadline import (
-    get_deadline_users,
-    get_timer_value,
+from deadline_scheduler import (
+    EXPIRED,
+    HOUR,
+    REMINDER_1H,
+    REMINDER_2H,
+    DeadlineEvent,
+    apply_remote_change,
     delete_deadline_timer,
-    increment_overdue_count,
     insert_deadline_timer,
+    load_deadlines,
+    maintain_deadlines,
+    scheduler,
+    timer_exists,
+)
+from keyed_locks import KeyedLocks
+from leases import USE_LEASES, maintain_leases, shard_leases
+from reminder_store import sent_reminders
+from metrics import deadline_event_latency, deadline_lag
+from player_pool import pool
+from stats_aggregates import increment_overdue_count, update_stats
+from timer_config import get_timer_value, timer_config
+from user_cache import (
+    change_in_game,
+    find_free_user,
+    get_game_with_participants,
+    get_users_by_id,
+    load_pool,
+    maintain_pool,
+    update_role_in_game,
 )
 from lexicon.lexicon_ru import lexicon
+from outbound import get_outbound
 from states.game import GameStates
 from keyboards.ins_report import ins_start_keyboard
 from keyboards.argument import judge_argument
@@ -39,7 +60,7 @@ async def appointment_new_executor(
     try:
         # Если новый исполнитель не является старым
         if new_user_id != old_user_id:
-            await bot.send_message(
+            get_outbound(bot).send_message(
                 chat_id=old_user_id,
                 text=lexicon["start_else"].format(old_user_info[3]),
                 reply_markup=await start_keyboard(role),
@@ -48,12 +69,11 @@ async def appointment_new_executor(
         time_delta = await get_timer_value("TZ")
         deadline_time = datetime.now() + timedelta(hours=time_delta)
         formatted_deadline_time = deadline_time.strftime("%d-%m-%Y %H:%M")
-        await bot.send_message(
+        get_outbound(bot).send_message(
             new_user_id,
             text=lexicon["start_game"].format(user_data[3], formatted_deadline_time),
         )
-        await asyncio.sleep(1)
-        await bot.send_message(
+        get_outbound(bot).send_message(
             new_user_id, text=lexicon["report_ts"].format(user_data[3])
         )
         await insert_deadline_timer(new_user_id, role, time_delta, "tz")
@@ -70,17 +90,18 @@ async def appointment_new_executor(
 
 # Функция для назначения нового проверяющего
 async def appointment_new_inspector(
-    bot: Bot, old_user_id: int, new_user_id: int, role: str
+    bot: Bot, old_user_id: int, new_user_id: int, role: str, game_id: int | None = None
 ) -> None:
     try:
         # Получаем текущую игру в которой участвует Проверяющий
-        game_id = await get_last_game_id_by_user_id(old_user_id)
+        if game_id is None:
+            game_id = await get_last_game_id_by_user_id(old_user_id)
         # Назначение нового игрока Проверяющим
         await update_role_in_game(game_id, "inspector", new_user_id)
         # Получение игры в которой участвовал Проверяющий
         game = await get_game_by_id(game_id)
         time_delta = await get_timer_value("Default")
-        await bot.send_message(
+        get_outbound(bot).send_message(
             chat_id=game[2],
             text=lexicon["report_exc"].format(game[6], game[7], time_delta),
             reply_markup=await ins_start_keyboard(game[1], game_id),
@@ -93,33 +114,34 @@ async def appointment_new_inspector(
 
 # Функция для назначения нового судьи
 async def appointment_new_judge(
-    bot: Bot, old_user_id: int, new_user_id: int, role: str
+    bot: Bot, old_user_id: int, new_user_id: int, role: str, game_id: int | None = None
 ) -> None:
     try:
         # Получаем текущую игру в которой участвует Судья
-        game_id = await get_last_game_id_by_user_id(old_user_id)
+        if game_id is None:
+            game_id = await get_last_game_id_by_user_id(old_user_id)
         # Назначение нового игрока Судьей
         await update_role_in_game(game_id, "judge", new_user_id)
-        game = await get_game_by_id(game_id)
-        args = await get_arg(game_id)
-        # Поучаем данные об участниках игры
-        executor = await get_users_by_id(game[1])
-        inspector = await get_users_by_id(game[2])
-        judge = await get_users_by_id(new_user_id)
+        # Игра, аргументы и все участники одним обращением
+        game, args, executor, inspector, judge, _ = await get_game_with_participants(
+            game_id, with_arguments=True
+        )
         time_delta = await get_timer_value("Default")
         # Отправка сообщения новому Судье
         text = lexicon["judge_start"].format(
-            judge[3],
-            f"{executor[2]} {executor[3]} {executor[4]}",
-            f"{inspector[2]} {inspector[3]} {inspector[4]}",
+            judge.first_name,
+            executor.full_name,
+            inspector.full_name,
             time_delta,
         )
-        await bot.send_message(new_user_id, text=text)
+        get_outbound(bot).send_message(new_user_id, text=text)
         # Установка таймера дедлайна на принятие новым судьей решения
         await insert_deadline_timer(new_user_id, "Судья", time_delta, "solve")
-        text = lexicon["judge_task"].format(game[5], game[6], game[8], args[2], args[3])
+        text = lexicon["judge_task"].format(
+            game.ts, game.with_error, game.all_errors, args[2], args[3]
+        )
         keyboard_judge = await judge_argument(game_id)
-        await bot.send_message(chat_id=game[3], text=text, reply_markup=keyboard_judge)
+        get_outbound(bot).send_message(chat_id=game.judge, text=text, reply_markup=keyboard_judge)
     except Exception as e:
         logging.error(f"Error in appointment_new_judge: {e}")
 
@@ -135,121 +157,291 @@ async def clear_status(user_id: int, bot: Bot, dp: Dispatcher) -> None:
         logging.error(f"Error in clear_status: {e}")
 
 
-# Множество для отслеживания отправленных уведомлений
-sent_notifications = set()
+# Функция для очистки состояния нескольких пользователей (одним запросом, если хранилище умеет)
+async def clear_statuses(user_ids: list[int], bot: Bot, dp: Dispatcher) -> None:
+    storage = dp.fsm.storage
+    if not hasattr(storage, "clear_many"):
+        for user_id in user_ids:
+            await clear_status(user_id, bot, dp)
+        return
+    try:
+        await storage.clear_many(
+            [StorageKey(user_id=user_id, chat_id=user_id, bot_id=bot.id) for user_id in user_ids]
+        )
+    except Exception as e:
+        logging.error(f"Error in clear_statuses: {e}")
+
+
+# Сколько просроченных дедлайнов обрабатывается одновременно
+EXPIRY_CONCURRENCY = 8
 
+# Просрочки одного пользователя и одной игры обрабатываются строго по очереди
+user_locks = KeyedLocks()
+game_locks = KeyedLocks()
 
-# Функция для проверки дедлайнов и отправки уведомлений
-async def check_deadlines(bot: Bot, dp: Dispatcher) -> None:
-    """Проверка дедлайнов и отправка уведомлений"""
-    while True:
-        try:
-            now = datetime.now()
-            now = now.replace(second=0, microsecond=0)
-            deadlines = await get_deadline_users()
-            for deadline in deadlines:
-                user_id, role, deadline_time, stage = deadline
-                deadline_time = datetime.strptime(deadline_time, "%Y-%m-%d %H:%M:%S.%f")
-                deadline_time = deadline_time.replace(second=0, microsecond=0)
-                # добавлаем ключи
-                notification_key_2h = (user_id, role, deadline_time, stage, "2h")
-                notification_key_1h = (user_id, role, deadline_time, stage, "1h")
-                if now > deadline_time:
+
+# Функция для обработки просроченного дедлайна
+async def handle_expired_deadline(
+    bot: Bot, dp: Dispatcher, user_id: int, role: str, stage: str, deadline_time: float
+) -> None:
+    async with user_locks(user_id):
+        # Таймер могли удалить в обход планировщика (игрок уже ответил)
+        if not await timer_exists(user_id, role, deadline_time, stage):
+            return
+        await delete_deadline_timer(user_id)
+        user_info = await get_users_by_id(user_id)
+        # Отменяем участие пользователя в игре в таблице users
+        await change_in_game(user_id, 0)
+        game_id = None
+        # До сдачи ТЗ у исполнителя ещё нет игры
+        if stage == "tz" and role != "Проверяющий":
+            await expire_stage(bot, dp, user_id, role, stage, user_info, None)
+        else:
+            game_id = await get_last_game_id_by_user_id(user_id)
+            async with game_locks(game_id):
+                await expire_stage(bot, dp, user_id, role, stage, user_info, game_id)
+        # Добавление в БД просрочки пользователя
+        await increment_overdue_count(user_id, role, game_id)
+        pool.record_overdue(user_id)
+
+
+# Функция для обработки просрочки в зависимости от этапа игры
+async def expire_stage(
+    bot: Bot,
+    dp: Dispatcher,
+    user_id: int,
+    role: str,
+    stage: str,
+    user_info: list,
+    game_id: int | None,
+) -> None:
+    match stage:
+        # В случае этапа ТЗ
+        case "tz":
+            text = lexicon["delay_tz"]
+            get_outbound(bot).send_message(chat_id=user_id, text=text)
+            if role == "Испольнитель":
+                # Очищаем его состояние
+                await clear_status(user_id, bot, dp)
+                # Находим нового исполнителя
+                new_user = await find_free_user(role)
+                # Назначаем нового исполнителя
+                await appointment_new_executor(
+                    bot, dp, user_id, new_user, role, user_info
+                )
+            if role == "Проверяющий":
+                # Очищаем его состояние
+                await clear_status(user_id, bot, dp)
+                # Находим нового проверяющего
+                new_user = await find_free_user(role)
+                # Назначаем нового инспектора
+                await appointment_new_inspector(bot, user_id, new_user, role, game_id)
+        # В случае при просрочке судьи
+        case "solve":
+            text = lexicon["delay_solve"]
+            get_outbound(bot).send_message(chat_id=user_id, text=text)
+            # Находим нового Судью
+            new_user = await find_free_user(role)
+            # Назначаем нового инспектора
+            await appointment_new_judge(bot, user_id, new_user, role, game_id)
+        case _:
+            # Получение данных о игроках в игре
+            participants = await get_game_with_participants(game_id)
+            game = participants.game
+            outbound = get_outbound(bot)
+            wins_ins = 0
+            # Отравляем уведомления о завершении игры
+            if role == "Исполнитель":
+                outbound.send_message(
+                    chat_id=game.inspector,
+                    text=f"{lexicon['win']}\n{lexicon['win_deadline_exe']}",
+                )
+                outbound.send_message(
+                    chat_id=game.executor,
+                    text=f"{lexicon['loose']}\n{lexicon['delay_answer']}",
+                )
+                outbound.send_message(
+                    chat_id=game.executor,
+                    text=lexicon["start_else"].format(participants.executor.first_name),
+                    reply_markup=await start_keyboard(role),
+                )
+            else:
+                wins_ins = 1
+                outbound.send_message(
+                    chat_id=game.executor,
+                    text=f"{lexicon['win']}\n{lexicon['win_deadline_ins']}",
+                )
+                outbound.send_message(
+                    chat_id=game.inspector,
+                    text=f"{lexicon['loose']}\n{lexicon['delay_answer']}",
+                )
+            # Обновление статистики игры
+            await update_stats(game, 0, wins_ins, overdue_role=role)
+            await clear_statuses([game.executor, game.inspector], bot, dp)
+
+
+# Функция для обработки просрочки в пуле с ограничением параллельности
+async def run_expiry(
+    bot: Bot, dp: Dispatcher, event: DeadlineEvent, slots: asyncio.Semaphore
+) -> None:
+    started = time.perf_counter()
+    try:
+        await handle_expired_deadline(
+            bot, dp, event.user_id, event.role, event.stage, event.deadline_time
+        )
+    except Exception as e:
+        logging.error(f"Error in run_expiry: {e}")
+    finally:
+        slots.release()
+        deadline_event_latency.observe(time.perf_counter() - started, kind=event.kind)
+
+
+# Просрочки, накопившиеся за время простоя, разбираются пачками с паузой
+CATCH_UP_BATCH = 20
+CATCH_UP_PAUSE = 5
+# Если задано, просроченным за время простоя таймерам даём столько часов вместо просрочки
+CATCH_UP_GRACE_HOURS = float(os.getenv("DEADLINE_GRACE_HOURS", "0"))
+
+
+# Функция для изъятия из планировщика уже просроченных таймеров (самые просроченные первыми)
+def take_overdue() -> list[tuple[int, str, float, str]]:
+    # Чужие шарды разберут их владельцы
+    backlog = [timer for timer in scheduler.due_before(time.time()) if shard_leases.owns(timer[0])]
+    # Забираем таймеры из планировщика, чтобы основной цикл не обработал их разом
+    for user_id, *_ in backlog:
+        scheduler.cancel(user_id)
+    return backlog
+
+
+# Функция для разбора просрочек, накопившихся пока бот был выключен
+async def catch_up_deadlines(
+    bot: Bot,
+    dp: Dispatcher,
+    slots: asyncio.Semaphore,
+    backlog: list[tuple[int, str, float, str]],
+    batch_size: int = CATCH_UP_BATCH,
+    pause: float = CATCH_UP_PAUSE,
+    grace_hours: float = CATCH_UP_GRACE_HOURS,
+) -> None:
+    if not backlog:
+        return
+    total = len(backlog)
+    logging.warning(f"Deadline catch-up: {total} timers expired during downtime")
+    for start in range(0, total, batch_size):
+        batch = backlog[start:start + batch_size]
+        if grace_hours > 0:
+            for user_id, role, _, stage in batch:
+                try:
                     await delete_deadline_timer(user_id)
-                    # сброс уведомления
-                    sent_notifications.discard(notification_key_2h)
-                    sent_notifications.discard(notification_key_1h)
-                    user_info = await get_users_by_id(user_id)
-                    # Отменяем участие пользователя в игре в таблице users
-                    await change_in_game(user_id, 0)
-                    match stage:
-                        # В случае этапа ТЗ
-                        case "tz":
-                            text = lexicon["delay_tz"]
-                            await bot.send_message(chat_id=user_id, text=text)
-                            if role == "Испольнитель":
-                                # Очищаем его состояние
-                                await clear_status(user_id, bot, dp)
-                                # Находим нового исполнителя
-                                new_user = await find_free_user(role)
-                                # Назначаем нового исполнителя
-                                await appointment_new_executor(
-                                    bot, dp, user_id, new_user, role, user_info
-                                )
-                            if role == "Проверяющий":
-                                # Очищаем его состояние
-                                await clear_status(user_id, bot, dp)
-                                # Находим нового проверяющего
-                                new_user = await find_free_user(role)
-                                # Назначаем нового инспектора
-                                await appointment_new_inspector(
-                                    bot, user_id, new_user, role
-                                )
-                        # В случае при просрочке судьи
-                        case "solve":
-                            await bot.send_message(chat_id=user_id, text=text)
-                            text = lexicon["delay_solve"]
-                            # Находим нового Судью
-                            new_user = await find_free_user(role)
-                            # Назначаем нового инспектора
-                            await appointment_new_judge(bot, user_id, new_user, role)
-                        case _:
-                            text = lexicon["delay_answer"]
-                            # Получаем текущую игру в которой участвует игроки
-                            game_id = await get_last_game_id_by_user_id(user_id)
-                            # Получение данных о игроках в игре
-                            game = await get_game_by_id(game_id)
-                            wins_ins = 0
-                            # Отравляем уведомления о завершении игры
-                            if role == "Исполнитель":
-                                await bot.send_message(
-                                    chat_id=game[2],
-                                    text=f"{lexicon['win']}\n{lexicon['win_deadline_exe']}",
-                                )
-                                await bot.send_message(
-                                    chat_id=game[1],
-                                    text=f"{lexicon['loose']}\n{lexicon['delay_answer']}",
-                                )
-                                await bot.send_message(
-                                    chat_id=game[1],
-                                    text=lexicon["start_else"].format(user_info[3]),
-                                    reply_markup=await start_keyboard(role),
-                                )
-                            else:
-                                wins_ins = 1
-                                await bot.send_message(
-                                    chat_id=game[1],
-                                    text=f"{lexicon['win']}\n{lexicon['win_deadline_ins']}",
-                                )
-                                await bot.send_message(
-                                    chat_id=game[2],
-                                    text=f"{lexicon['loose']}\n{lexicon['delay_answer']}",
-                                )
-                            # Обновление статистики игры
-                            await update_stats(game, 0, wins_ins, overdue_role=role)
-                            await clear_status(game[1], bot, dp)
-                            await clear_status(game[2], bot, dp)
-                    # Добавление в БД просрочки пользователя
-                    await increment_overdue_count(user_id)
-
-                # Уведомления за 2 часа до дедлайна
-                elif now >= deadline_time - timedelta(
-                    hours=2
-                ) and now < deadline_time - timedelta(hours=1):
-                    if notification_key_2h not in sent_notifications:
-                        await bot.send_message(
-                            chat_id=user_id, text=lexicon["two_hour_left"]
-                        )
-                        sent_notifications.add(notification_key_2h)
+                    await insert_deadline_timer(user_id, role, grace_hours, stage)
+                except Exception as e:
+                    logging.error(f"Error in catch_up_deadlines: {e}")
+        else:
+            tasks = []
+            for user_id, role, deadline_time, stage in batch:
+                event = DeadlineEvent(user_id, role, deadline_time, stage, EXPIRED, -1)
+                await slots.acquire()
+                tasks.append(asyncio.create_task(run_expiry(bot, dp, event, slots)))
+            await asyncio.gather(*tasks)
+        done = min(start + batch_size, total)
+        logging.warning(f"Deadline catch-up: {done}/{total} processed")
+        if done < total:
+            await asyncio.sleep(pause)
 
-                # Уведомления за 1 часа до дедлайна
-                elif now >= deadline_time - timedelta(hours=1) and now < deadline_time:
-                    if notification_key_1h not in sent_notifications:
-                        await bot.send_message(
-                            chat_id=user_id, text=lexicon["one_hour_left"]
-                        )
-                        sent_notifications.add(notification_key_1h)
 
-            await asyncio.sleep(60)
-        except Exception as e:
-            logging.error(f"Error in check_deadlines: {e}")
+# Функция для отправки напоминания за 2 часа / 1 час до дедлайна
+async def send_deadline_reminder(bot: Bot, event: DeadlineEvent) -> None:
+    # Дедлайн в ключе тот же, что записан в БД (см. insert_deadline_timer),
+    # поэтому после перезапуска ключ совпадает
+    notification_key = (event.user_id, event.role, event.stage, event.kind, event.deadline_time)
+    if notification_key in sent_reminders:
+        return
+    if not await timer_exists(event.user_id, event.role, event.deadline_time, event.stage):
+        return
+    text = lexicon["two_hour_left" if event.kind == REMINDER_2H else "one_hour_left"]
+    get_outbound(bot).send_message(chat_id=event.user_id, text=text)
+    await sent_reminders.add(notification_key)
+
+
+# Функция для проверки дедлайнов и отправки уведомлений
+async def check_deadlines(
+    bot: Bot,
+    dp: Dispatcher,
+    concurrency: int = EXPIRY_CONCURRENCY,
+    use_leases: bool = USE_LEASES,
+    catch_up_pause: float = CATCH_UP_PAUSE,
+) -> None:
+    """Обработка событий дедлайнов: спим до ближайшего события планировщика.
+
+    С use_leases несколько процессов делят таймеры по шардам и забирают
+    шарды упавшего воркера после истечения его аренды.
+    """
+    slots = asyncio.Semaphore(concurrency)
+    expiries = set()
+    # Фоновые задачи цикла: отменяются при выходе из check_deadlines
+    background = []
+    catch_up_tasks = set()
+    loaded = False
+
+    # Просроченные таймеры (после старта или перехода шардов) разбираются с паузами
+    def catch_up() -> None:
+        task = asyncio.create_task(
+            catch_up_deadlines(bot, dp, slots, take_overdue(), pause=catch_up_pause)
+        )
+        catch_up_tasks.add(task)
+        task.add_done_callback(catch_up_tasks.discard)
+
+    # Отложенные события полученных шардов тоже не запускаем разом
+    def on_shards_acquired() -> None:
+        scheduler.resume_deferred()
+        catch_up()
+
+    try:
+        while True:
+            try:
+                if not loaded:
+                    await timer_config.load()
+                    await load_pool()
+                    if use_leases:
+                        await shard_leases.start()
+                        await shard_leases.renew()
+                    await load_deadlines()
+                    # Накопившиеся просрочки разбираем отдельно, не задерживая новые события
+                    catch_up()
+                    if use_leases:
+                        background.append(
+                            asyncio.create_task(maintain_leases(apply_remote_change, on_shards_acquired))
+                        )
+                    # Таймеры, изменённые в обход планировщика, подхватываем сверкой с БД
+                    background.append(asyncio.create_task(maintain_deadlines()))
+                    background.append(asyncio.create_task(maintain_pool()))
+                    loaded = True
+                event = await scheduler.next_due()
+                # Насколько позже срока сработало событие
+                fire_at = event.deadline_time - {REMINDER_2H: 2 * HOUR, REMINDER_1H: HOUR}.get(event.kind, 0)
+                deadline_lag.observe(max(time.time() - fire_at, 0), kind=event.kind)
+                if event.kind == EXPIRED:
+                    # сброс уведомлений с прошедшим дедлайном
+                    await sent_reminders.evict(event.deadline_time + 1)
+                    # Ждём свободный слот, чтобы не запускать неограниченно задач
+                    await slots.acquire()
+                    task = asyncio.create_task(run_expiry(bot, dp, event, slots))
+                    expiries.add(task)
+                    task.add_done_callback(expiries.discard)
+                else:
+                    started = time.perf_counter()
+                    await send_deadline_reminder(bot, event)
+                    deadline_event_latency.observe(time.perf_counter() - started, kind=event.kind)
+            except Exception as e:
+                logging.error(f"Error in check_deadlines: {e}")
+                if not loaded:
+                    await asyncio.sleep(60)
+    finally:
+        for task in background:
+            task.cancel()
+        # Остановленный воркер сразу отдаёт шарды, не дожидаясь истечения аренды
+        if shard_leases.enabled:
+            try:
+                await shard_leases.release()
+            except Exception as e:
+                logging.error(f"Error in check_deadlines: {e}")
@@ -0,0 +1,140 @@
+import asyncio
+import heapq
+import logging
+import time
+from collections import deque
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+
+# Лимиты Telegram: ~30 сообщений в секунду на бота и ~1 в секунду в один чат
+GLOBAL_RATE = 30
+CHAT_INTERVAL = 1.0
+
+
+class OutboundDispatcher:
+    """Очередь исходящих сообщений с учётом лимитов Telegram.
+
+    Сообщения одного чата отправляются строго по порядку, обработчик не ждёт
+    отправки: методы возвращают Future, который можно при желании await-ить.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        global_rate: float = GLOBAL_RATE,
+        chat_interval: float = CHAT_INTERVAL,
+    ) -> None:
+        self._bot = bot
+        self._global_interval = 1 / global_rate
+        self._chat_interval = chat_interval
+        # chat_id -> очередь (метод, аргументы, future)
+        self._queues: dict[int, deque] = {}
+        # Куча (время, когда чату можно отправлять, chat_id) для чатов без отправки в полёте
+        self._ready: list[tuple[float, int]] = []
+        self._next_send = 0.0
+        self._paused_until = 0.0
+        self._wakeup = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._worker: asyncio.Task | None = None
+        # Ссылки на отправки в полёте: иначе задачу может собрать сборщик мусора,
+        # и очередь её чата остановится навсегда
+        self._sending: set[asyncio.Task] = set()
+
+    @property
+    def depth(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def send_message(self, chat_id: int, **kwargs) -> asyncio.Future:
+        return self._enqueue(chat_id, "send_message", kwargs)
+
+    def send_document(self, chat_id: int, **kwargs) -> asyncio.Future:
+        return self._enqueue(chat_id, "send_document", kwargs)
+
+    # Функция ожидания отправки всех сообщений из очереди
+    async def join(self) -> None:
+        await self._idle.wait()
+
+    def _enqueue(self, chat_id: int, method: str, kwargs: dict) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        future.add_done_callback(_log_failure)
+        queue = self._queues.get(chat_id)
+        if queue is None:
+            queue = self._queues[chat_id] = deque()
+            heapq.heappush(self._ready, (time.monotonic(), chat_id))
+        queue.append((method, kwargs, future))
+        self._idle.clear()
+        self._wakeup.set()
+        if self._worker is None or self._worker.done():
+            self._worker = loop.create_task(self._run())
+        return future
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            if not self._ready:
+                if not self._queues:
+                    self._idle.set()
+                await self._wakeup.wait()
+                continue
+            ready_at, chat_id = self._ready[0]
+            delay = max(ready_at, self._next_send, self._paused_until) - time.monotonic()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self._ready)
+            self._next_send = time.monotonic() + self._global_interval
+            task = asyncio.create_task(self._send(chat_id))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _send(self, chat_id: int) -> None:
+        queue = self._queues[chat_id]
+        method, kwargs, future = queue[0]
+        retry_at = None
+        try:
+            result = await getattr(self._bot, method)(chat_id=chat_id, **kwargs)
+        except TelegramRetryAfter as e:
+            # Flood control: повторяем то же сообщение после паузы
+            retry_at = time.monotonic() + e.retry_after
+            self._paused_until = max(self._paused_until, retry_at)
+        except Exception as e:
+            queue.popleft()
+            if not future.done():
+                future.set_exception(e)
+        else:
+            queue.popleft()
+            if not future.done():
+                future.set_result(result)
+        if queue:
+            ready_at = retry_at or time.monotonic() + self._chat_interval
+            heapq.heappush(self._ready, (ready_at, chat_id))
+        else:
+            del self._queues[chat_id]
+        self._wakeup.set()
+
+
+def _log_failure(future: asyncio.Future) -> None:
+    if not future.cancelled() and future.exception() is not None:
+        logging.error(f"Error in outbound: {future.exception()}")
+
+
+_dispatchers: dict[int, OutboundDispatcher] = {}
+
+
+# Функция для получения общего числа сообщений в очередях всех ботов
+def queue_depth() -> int:
+    return sum(dispatcher.depth for dispatcher in _dispatchers.values())
+
+
+# Функция для получения общей очереди исходящих сообщений бота
+def get_outbound(bot: Bot) -> OutboundDispatcher:
+    dispatcher = _dispatchers.get(id(bot))
+    if dispatcher is None:
+        dispatcher = _dispatchers[id(bot)] = OutboundDispatcher(bot)
+    return dispatcher
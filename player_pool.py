@@ -0,0 +1,110 @@
+import heapq
+import itertools
+import time
+from typing import Callable
+
+
+class PlayerStats:
+    __slots__ = ("role", "free", "last_assigned", "overdue", "entry")
+
+    def __init__(self, role: str) -> None:
+        self.role = role
+        self.free = False
+        self.last_assigned = 0.0
+        self.overdue = 0
+        # Номер актуальной записи в куче (старые записи пропускаются)
+        self.entry = -1
+
+
+# Политики выбора: чем меньше приоритет, тем раньше игрок будет выбран
+def least_recently_assigned(stats: PlayerStats):
+    return stats.last_assigned
+
+
+def fewest_overdue(stats: PlayerStats):
+    return stats.overdue, stats.last_assigned
+
+
+class PlayerPool:
+    """Индекс свободных игроков по ролям с выбором следующего за O(log n)"""
+
+    def __init__(self, policy: Callable[[PlayerStats], object] = least_recently_assigned) -> None:
+        self.policy = policy
+        self._players: dict[int, PlayerStats] = {}
+        # role -> куча (приоритет, номер записи, user_id)
+        self._free: dict[str, list] = {}
+        self._seq = itertools.count()
+
+    def __len__(self) -> int:
+        return sum(1 for stats in self._players.values() if stats.free)
+
+    def _push(self, user_id: int, stats: PlayerStats) -> None:
+        stats.entry = next(self._seq)
+        heapq.heappush(
+            self._free.setdefault(stats.role, []), (self.policy(stats), stats.entry, user_id)
+        )
+
+    # Функция для смены роли игрока (пустая роль убирает его из пула)
+    def set_role(self, user_id: int, role: str | None) -> None:
+        stats = self._players.get(user_id)
+        if not role:
+            self._players.pop(user_id, None)
+            return
+        if stats is None:
+            stats = self._players[user_id] = PlayerStats(role)
+            stats.free = True
+        stats.role = role
+        if stats.free:
+            self._push(user_id, stats)
+
+    # Функция для заполнения пула из БД: (user_id, роль, свободен ли, число просрочек)
+    def load(self, players) -> None:
+        self._players.clear()
+        self._free.clear()
+        for user_id, role, free, overdue in players:
+            if not role:
+                continue
+            stats = self._players[user_id] = PlayerStats(role)
+            stats.overdue = overdue
+            stats.free = free
+            if free:
+                self._push(user_id, stats)
+
+    # Функция для возврата игрока в пул после окончания игры
+    def release(self, user_id: int) -> None:
+        stats = self._players.get(user_id)
+        if stats is not None and not stats.free:
+            stats.free = True
+            self._push(user_id, stats)
+
+    # Функция для отметки игрока занятым (запись в куче станет неактуальной)
+    def occupy(self, user_id: int, role: str | None = None) -> None:
+        stats = self._players.get(user_id)
+        if stats is None:
+            if not role:
+                return
+            stats = self._players[user_id] = PlayerStats(role)
+        stats.free = False
+        stats.entry = -1
+        stats.last_assigned = time.time()
+
+    def record_overdue(self, user_id: int) -> None:
+        stats = self._players.get(user_id)
+        if stats is not None:
+            stats.overdue += 1
+            if stats.free:
+                self._push(user_id, stats)
+
+    # Функция для выбора следующего свободного игрока роли
+    def pick(self, role: str) -> int | None:
+        heap = self._free.get(role)
+        while heap:
+            _, entry, user_id = heapq.heappop(heap)
+            stats = self._players.get(user_id)
+            if stats is not None and stats.free and stats.entry == entry and stats.role == role:
+                self.occupy(user_id)
+                return user_id
+        return None
+
+
+pool = PlayerPool()
@@ -0,0 +1,48 @@
+from typing import NamedTuple
+
+
+class UserRecord(NamedTuple):
+    """Нужные обработчикам колонки строки таблицы users"""
+
+    user_id: int
+    username: str
+    last_name: str
+    first_name: str
+    middle_name: str
+    role: str
+    in_game: int
+
+    @classmethod
+    def from_row(cls, row) -> "UserRecord":
+        return cls(row[0], row[1], row[2], row[3], row[4], row[6], row[10])
+
+    @property
+    def full_name(self) -> str:
+        return f"{self.last_name} {self.first_name} {self.middle_name}"
+
+
+class GameRecord(NamedTuple):
+    game_id: int
+    executor: int
+    inspector: int
+    judge: int
+    admin: int
+    ts: str
+    with_error: str
+    without_error: str
+    all_errors: str
+    count_errors: str
+
+    @classmethod
+    def from_row(cls, row) -> "GameRecord":
+        return cls(*row[:10])
+
+
+class GameParticipants(NamedTuple):
+    game: GameRecord
+    # Строка аргументов игры (get_arg), если её запрашивали
+    arguments: tuple | None
+    executor: UserRecord | None
+    inspector: UserRecord | None
+    judge: UserRecord | None
+    admin: UserRecord | None
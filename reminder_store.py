@@ -0,0 +1,89 @@
+import heapq
+import time
+
+import local_storage
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sent_reminders (
+    user_id INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    deadline REAL NOT NULL,
+    PRIMARY KEY (user_id, role, stage, kind, deadline)
+);
+CREATE INDEX IF NOT EXISTS sent_reminders_deadline ON sent_reminders (deadline);
+"""
+
+# (user_id, role, stage, kind, epoch дедлайна)
+ReminderKey = tuple[int, str, str, str, float]
+
+
+class SentReminders:
+    """Отправленные напоминания: хранятся до дедлайна и переживают перезапуск"""
+
+    def __init__(self) -> None:
+        self._keys: dict[int, set[ReminderKey]] = {}
+        # Куча (дедлайн, ключ) для вытеснения по времени
+        self._by_deadline: list[tuple[float, ReminderKey]] = []
+        self._loaded = False
+
+    def __contains__(self, key: ReminderKey) -> bool:
+        return key in self._keys.get(key[0], ())
+
+    def __len__(self) -> int:
+        return sum(len(keys) for keys in self._keys.values())
+
+    # Функция для загрузки актуальных напоминаний после перезапуска
+    async def load(self) -> None:
+        await local_storage.ensure_schema(_SCHEMA)
+        await local_storage.execute(
+            "DELETE FROM sent_reminders WHERE deadline < ?", (time.time(),)
+        )
+        rows = await local_storage.execute(
+            "SELECT user_id, role, stage, kind, deadline FROM sent_reminders"
+        )
+        self._keys = {}
+        for row in rows:
+            self._keys.setdefault(row[0], set()).add(tuple(row))
+        self._by_deadline = [(row[4], tuple(row)) for row in rows]
+        heapq.heapify(self._by_deadline)
+        self._loaded = True
+
+    async def add(self, key: ReminderKey) -> None:
+        if not self._loaded:
+            await self.load()
+        await local_storage.execute(
+            "INSERT OR IGNORE INTO sent_reminders VALUES (?, ?, ?, ?, ?)", key
+        )
+        self._keys.setdefault(key[0], set()).add(key)
+        heapq.heappush(self._by_deadline, (key[4], key))
+
+    # Функция для сброса напоминаний пользователя (при удалении его таймеров)
+    async def discard_user(self, user_id: int) -> None:
+        if not self._loaded or self._keys.pop(user_id, None) is None:
+            return
+        await local_storage.execute(
+            "DELETE FROM sent_reminders WHERE user_id = ?", (user_id,)
+        )
+
+    # Функция для вытеснения напоминаний с прошедшим дедлайном
+    async def evict(self, now: float) -> None:
+        if not self._loaded:
+            return
+        expired = False
+        while self._by_deadline and self._by_deadline[0][0] < now:
+            _, key = heapq.heappop(self._by_deadline)
+            keys = self._keys.get(key[0])
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys[key[0]]
+            expired = True
+        if expired:
+            await local_storage.execute(
+                "DELETE FROM sent_reminders WHERE deadline < ?", (now,)
+            )
+
+
+sent_reminders = SentReminders()
@@ -1,20 +1,28 @@
 import asyncio
 import logging
+import time
 from datetime import datetime, timedelta
 from aiogram.enums import ParseMode
 from aiogram.fsm.context import FSMContext
 from aiogram.types import CallbackQuery, Message
-from database.timers_deadline import insert_deadline_timer, delete_deadline_timer, get_timer_value
+from timer_config import get_timer_value
+from deadline_scheduler import insert_deadline_timer, delete_deadline_timer, scheduler
 from keyboards.start_keyboard import start_keyboard
 from lexicon.lexicon_ru import lexicon
 from states.game import GameStates
 from config.bot_config import bot
 from keyboards.admin_solve import admin_solve_keyboard
+from metrics import instrument
+from outbound import get_outbound
 
 import database.commands as db
+from game_journal import GAME_SUBMITTED, journal
+import stats_aggregates
+import user_cache
 from utils import capitalize
 
 # Функция для начала игры
+@instrument
 async def start_game(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
     try:
@@ -24,8 +32,7 @@ async def start_game(callback: CallbackQuery, state: FSMContext):
             deadline_time = datetime.now() + timedelta(hours=time_delta)
             formatted_deadline_time = deadline_time.strftime("%Y/%m/%d %H:%M")
             await callback.message.edit_text(text=lexicon['start_game'].format(user[3], formatted_deadline_time))
-            await asyncio.sleep(1)
-            await callback.message.answer(text=lexicon['report_ts'].format(user[3]))
+            get_outbound(bot).send_message(callback.message.chat.id, text=lexicon['report_ts'].format(user[3]))
             await state.set_state(GameStates.TS)
 
             await insert_deadline_timer(user[0], "Исполнитель", time_delta, "tz")
@@ -38,10 +45,11 @@ async def start_game(callback: CallbackQuery, state: FSMContext):
         await callback.message.edit_text(text=lexicon['err_start_game'])
 
 # Функция для получения ТЗ
+@instrument
 async def get_ts(message: Message, state: FSMContext):
     try:
         document_id = message.text
-        user = await db.get_users_by_id(message.chat.id)
+        user = await user_cache.get_users_by_id(message.chat.id)
         await state.update_data(ts=document_id)
         await message.answer(text=lexicon['report_with_error'].format(user[3]))
         await state.set_state(GameStates.WITH_ERROR)
@@ -50,10 +58,11 @@ async def get_ts(message: Message, state: FSMContext):
         await message.answer(text=lexicon['document_error'])
 
 # Функция для получения отчета с ошибками
+@instrument
 async def get_report_with_error(message: Message, state: FSMContext):
     try:
         document_id = message.text
-        user = await db.get_users_by_id(message.chat.id)
+        user = await user_cache.get_users_by_id(message.chat.id)
         await state.update_data(with_error=document_id)
         await message.answer(text=lexicon['report_without_error'].format(user[3]))
         await state.set_state(GameStates.WITHOUT_ERROR)
@@ -62,10 +71,11 @@ async def get_report_with_error(message: Message, state: FSMContext):
         await message.answer(text=lexicon['document_error'])
 
 # Функция для получения отчета без ошибок
+@instrument
 async def get_report_without_error(message: Message, state: FSMContext):
     try:
         document_id = message.text
-        user = await db.get_users_by_id(message.chat.id)
+        user = await user_cache.get_users_by_id(message.chat.id)
         await state.update_data(without_error=document_id)
         await message.answer(text=lexicon['all_errors'].format(user[3]))
         await state.set_state(GameStates.ERRORS)
@@ -74,9 +84,10 @@ async def get_report_without_error(message: Message, state: FSMContext):
         await message.answer(text=lexicon['document_error'])
 
 # Функция для получения всех ошибок
+@instrument
 async def get_all_errors(message: Message, state: FSMContext):
     try:
-        user = await db.get_users_by_id(message.chat.id)
+        user = await user_cache.get_users_by_id(message.chat.id)
         await state.update_data(all_errors=message.text)
         await message.answer(text=lexicon['count_errors'].format(user[3]), parse_mode=ParseMode.HTML)
         await state.set_state(GameStates.COUNT)
@@ -84,32 +95,60 @@ async def get_all_errors(message: Message, state: FSMContext):
         logging.error(f"Error in get_all_errors: {e}")
         await message.answer(text=lexicon['document_error'])
 
+# Функция для сохранения игры исполнителя: возвращает созданную игру и админа
+async def submit_game(executor_id: int, data: dict):
+    # Момент выдачи задания запомнен при создании таймера; после удаления таймера его уже нет
+    issued_at = scheduler.issued_at(executor_id)
+    # Сначала удаляем дедлайн исполнителя, затем записываем игру: если удаление
+    # упадёт, игра не создастся и повторная сдача не сделает дубликат
+    await delete_deadline_timer(executor_id)
+    res = await user_cache.insert_new_game(executor_id, **data)
+    if not res:
+        return None, None
+    if issued_at is not None:
+        try:
+            await stats_aggregates.record_submit(executor_id, "Исполнитель", time.time() - issued_at)
+        except Exception as e:
+            logging.error(f"Error in submit_game: {e}")
+    # Берём игру этого исполнителя, а не последнюю в таблице: при одновременной
+    # сдаче двумя исполнителями get_last_game() мог вернуть чужую игру.
+    # Если insert_new_game вернул id новой игры, лишний запрос не нужен
+    if isinstance(res, int) and not isinstance(res, bool):
+        game_id = res
+    else:
+        game_id = await db.get_last_game_id_by_user_id(executor_id)
+    game = await db.get_game_by_id(game_id)
+    user_cache.game_created(game)
+    admin = await user_cache.get_users_by_id(game[4])
+    journal.record(
+        GAME_SUBMITTED, game_id, executor_id,
+        executor=game[1], inspector=game[2], judge=game[3], admin=game[4],
+    )
+    return game, admin
+
 # Функция для получения количества ошибок
+@instrument
 async def get_count_errors(message: Message, state: FSMContext):
     try:
-        user = await db.get_users_by_id(message.chat.id)
+        user = await user_cache.get_users_by_id(message.chat.id)
         await state.update_data(count_errors=message.text)
         await message.answer(text=lexicon['finish_get_reports'].format(user[3]))
-        # Удаление дедлайна для исполнителя после отправки ТЗ
-        await delete_deadline_timer(user[0])
 
         data = await state.get_data()
 
         if 'user_id' in data.keys():
             del data['user_id']
-        res = await db.insert_new_game(message.chat.id, **data)
-        if not res:
-            await message.answer(text=lexicon['not_users_game'].format(user[3]))
-            await asyncio.sleep(0.5)
-            await message.answer(text=lexicon["start_else"].format(capitalize(message.from_user.first_name)),
-                                 reply_markup=await start_keyboard(user[6]))
+        game, admin = await submit_game(user[0], data)
+        if game is None:
+            outbound = get_outbound(bot)
+            outbound.send_message(message.chat.id, text=lexicon['not_users_game'].format(user[3]))
+            outbound.send_message(message.chat.id,
+                                  text=lexicon["start_else"].format(capitalize(message.from_user.first_name)),
+                                  reply_markup=await start_keyboard(user[6]))
             return
 
-        game = await db.get_last_game()
-        admin = await db.get_users_by_id(game[4])
-
-        await bot.send_message(chat_id=game[4], text=lexicon['report_to_admin'].format(admin[3], user[3], game[5], game[6]),
-                               reply_markup=await admin_solve_keyboard(game[0], 1), disable_web_page_preview=True)
+        get_outbound(bot).send_message(game[4], text=lexicon['report_to_admin'].format(admin[3], user[3], game[5], game[6]),
+                                       reply_markup=await admin_solve_keyboard(game[0], 1), disable_web_page_preview=True)
 
         await state.set_state(None)
     except Exception as e:
@@ -0,0 +1,242 @@
+import asyncio
+import logging
+import sqlite3
+import time
+from collections import defaultdict
+
+import local_storage
+from exporter import DB_PATH
+from game_journal import GAME_FINISHED, OVERDUE, journal
+from database.commands import update_stats as db_update_stats
+from database.timers_deadline import increment_overdue_count as db_increment_overdue_count
+
+# Колонки, по которым можно строить таблицу лидеров
+LEADERBOARD_COLUMNS = ("wins", "games", "overdue")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS player_stats (
+    user_id INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    games INTEGER NOT NULL DEFAULT 0,
+    wins INTEGER NOT NULL DEFAULT 0,
+    overdue INTEGER NOT NULL DEFAULT 0,
+    submit_seconds REAL NOT NULL DEFAULT 0,
+    submits INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, role)
+);
+CREATE INDEX IF NOT EXISTS player_stats_wins ON player_stats (role, wins DESC, user_id);
+CREATE INDEX IF NOT EXISTS player_stats_games ON player_stats (role, games DESC, user_id);
+CREATE INDEX IF NOT EXISTS player_stats_overdue ON player_stats (role, overdue DESC, user_id);
+CREATE TABLE IF NOT EXISTS role_stats (
+    role TEXT PRIMARY KEY,
+    games INTEGER NOT NULL DEFAULT 0,
+    wins INTEGER NOT NULL DEFAULT 0,
+    overdue INTEGER NOT NULL DEFAULT 0,
+    submit_seconds REAL NOT NULL DEFAULT 0,
+    submits INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS stats_backfill (
+    done_at REAL NOT NULL
+);
+"""
+
+_UPSERT_PLAYER = (
+    "INSERT INTO player_stats (user_id, role, games, wins, overdue, submit_seconds, submits) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT(user_id, role) DO UPDATE SET "
+    "games = games + excluded.games, wins = wins + excluded.wins, "
+    "overdue = overdue + excluded.overdue, "
+    "submit_seconds = submit_seconds + excluded.submit_seconds, "
+    "submits = submits + excluded.submits"
+)
+_UPSERT_ROLE = (
+    "INSERT INTO role_stats (role, games, wins, overdue, submit_seconds, submits) "
+    "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(role) DO UPDATE SET "
+    "games = games + excluded.games, wins = wins + excluded.wins, "
+    "overdue = overdue + excluded.overdue, "
+    "submit_seconds = submit_seconds + excluded.submit_seconds, "
+    "submits = submits + excluded.submits"
+)
+
+_ready = False
+_schema_lock = asyncio.Lock()
+
+
+# При первом запуске агрегаты заполняются историей из БД игры
+async def _ensure_schema() -> None:
+    global _ready
+    if _ready:
+        return
+    async with _schema_lock:
+        if not _ready:
+            await local_storage.ensure_schema(_SCHEMA)
+            rows = await local_storage.execute("SELECT count(*) FROM stats_backfill")
+            if not rows[0][0]:
+                await _backfill(DB_PATH)
+            _ready = True
+
+
+# Победитель игры: при просрочке выигрывает сторона, которая не просрочила.
+# Без просрочки (решение судьи) флаги wins_exe / wins_ins указывают победителя
+def _winner(game, wins_exe: int, wins_ins: int, overdue_role: str | None) -> int | None:
+    if overdue_role:
+        return game[2] if overdue_role == "Исполнитель" else game[1]
+    if wins_exe:
+        return game[1]
+    if wins_ins:
+        return game[2]
+    return None
+
+
+# Функция для подсчёта (games, wins, overdue) по игрокам из таблиц БД игры (только чтение).
+# Колонки stats_task называются как аргументы update_stats
+def _read_history(db_path: str) -> dict[tuple[int, str], list[int]]:
+    connection = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        roles = {user[0]: user[6] for user in connection.execute("SELECT * FROM users")}
+        games = {game[0]: game for game in connection.execute("SELECT * FROM games")}
+        cursor = connection.execute("SELECT * FROM stats_task")
+        columns = {column[0]: index for index, column in enumerate(cursor.description)}
+        results = [
+            (row[columns["game_id"]], row[columns["wins_exe"]], row[columns["wins_ins"]], row[columns["overdue_role"]])
+            for row in cursor
+        ]
+        overdue = connection.execute("SELECT * FROM overdue_count").fetchall()
+    finally:
+        connection.close()
+    players = defaultdict(lambda: [0, 0, 0])
+    for game_id, wins_exe, wins_ins, overdue_role in results:
+        game = games.get(game_id)
+        if game is None:
+            continue
+        winner = _winner(game, wins_exe, wins_ins, overdue_role)
+        for user_id, role in ((game[1], "Исполнитель"), (game[2], "Проверяющий")):
+            totals = players[(user_id, role)]
+            totals[0] += 1
+            totals[1] += int(user_id == winner)
+    # Роль просрочки не хранится: относим просрочки к текущей роли игрока
+    for user_id, count in overdue:
+        if roles.get(user_id):
+            players[(user_id, roles[user_id])][2] += count
+    return players
+
+
+# Функция для пересчёта games/wins/overdue по истории БД игры (время сдачи ТЗ сохраняется)
+async def _backfill(db_path: str) -> None:
+    try:
+        players = await asyncio.to_thread(_read_history, db_path)
+    except Exception as e:
+        # Повторим при следующем запуске
+        logging.error(f"Error in _backfill: {e}")
+        return
+    statements = [
+        ("UPDATE player_stats SET games = 0, wins = 0, overdue = 0", ()),
+        ("UPDATE role_stats SET games = 0, wins = 0, overdue = 0", ()),
+    ]
+    roles = defaultdict(lambda: [0, 0, 0])
+    for (user_id, role), totals in players.items():
+        statements.append((_UPSERT_PLAYER, (user_id, role, *totals, 0, 0)))
+        for index, value in enumerate(totals):
+            roles[role][index] += value
+    for role, totals in roles.items():
+        statements.append((_UPSERT_ROLE, (role, *totals, 0, 0)))
+    statements.append(("INSERT INTO stats_backfill VALUES (?)", (time.time(),)))
+    await local_storage.execute_batch(statements)
+
+
+# Функция для пересчёта агрегатов по БД игры: подхватывает итоги, записанные в обход update_stats
+async def backfill(db_path: str = DB_PATH) -> None:
+    await _ensure_schema()
+    await _backfill(db_path)
+
+
+# Функция для прибавления к агрегатам игрока и его роли одной транзакцией
+async def _add(
+    user_id: int,
+    role: str,
+    games: int = 0,
+    wins: int = 0,
+    overdue: int = 0,
+    submit_seconds: float = 0,
+    submits: int = 0,
+) -> None:
+    await _ensure_schema()
+    values = (games, wins, overdue, submit_seconds, submits)
+    await local_storage.execute_batch(
+        [(_UPSERT_PLAYER, (user_id, role) + values), (_UPSERT_ROLE, (role,) + values)]
+    )
+
+
+# Функция для записи итогов игры в БД и в агрегаты исполнителя и проверяющего.
+# Решения судьи вызывают database.commands.update_stats напрямую: их итоги
+# попадают в агрегаты только через backfill() (при первом запуске или вручную)
+async def update_stats(game, wins_exe: int, wins_ins: int, overdue_role: str = None) -> None:
+    # Схема (и первичное заполнение) до записи в БД, чтобы игра не попала в агрегаты дважды
+    await _ensure_schema()
+    await db_update_stats(game, wins_exe, wins_ins, overdue_role=overdue_role)
+    journal.record(GAME_FINISHED, game[0], wins_exe=wins_exe, wins_ins=wins_ins, overdue_role=overdue_role)
+    winner = _winner(game, wins_exe, wins_ins, overdue_role)
+    statements = []
+    for user_id, role in ((game[1], "Исполнитель"), (game[2], "Проверяющий")):
+        values = (1, int(user_id == winner), 0, 0, 0)
+        statements.append((_UPSERT_PLAYER, (user_id, role) + values))
+        statements.append((_UPSERT_ROLE, (role,) + values))
+    await local_storage.execute_batch(statements)
+
+
+# Функция для учёта просрочки в БД и в агрегатах
+async def increment_overdue_count(user_id: int, role: str, game_id: int = None) -> None:
+    await _ensure_schema()
+    await db_increment_overdue_count(user_id)
+    journal.record(OVERDUE, game_id, user_id, role=role)
+    await _add(user_id, role, overdue=1)
+
+
+# Функция для учёта времени от выдачи задания до сдачи ТЗ
+async def record_submit(user_id: int, role: str, seconds: float) -> None:
+    await _add(user_id, role, submit_seconds=max(seconds, 0), submits=1)
+
+
+def _record(row: tuple) -> dict:
+    user_id, role, games, wins, overdue, submit_seconds, submits = row
+    return {
+        "user_id": user_id,
+        "role": role,
+        "games": games,
+        "wins": wins,
+        "losses": games - wins,
+        "overdue": overdue,
+        "avg_submit_seconds": submit_seconds / submits if submits else None,
+    }
+
+
+# Функция для получения первых n игроков роли по выбранной колонке (идёт по индексу)
+async def leaderboard(role: str, limit: int = 10, by: str = "wins") -> list[dict]:
+    if by not in LEADERBOARD_COLUMNS:
+        raise ValueError(f"Unknown leaderboard column: {by}")
+    await _ensure_schema()
+    rows = await local_storage.execute(
+        "SELECT user_id, role, games, wins, overdue, submit_seconds, submits FROM player_stats "
+        f"WHERE role = ? ORDER BY {by} DESC, user_id LIMIT ?",
+        (role, limit),
+    )
+    return [_record(row) for row in rows]
+
+
+# Функция для получения агрегатов игрока по всем его ролям
+async def player_stats(user_id: int) -> list[dict]:
+    await _ensure_schema()
+    rows = await local_storage.execute(
+        "SELECT user_id, role, games, wins, overdue, submit_seconds, submits FROM player_stats "
+        "WHERE user_id = ?",
+        (user_id,),
+    )
+    return [_record(row) for row in rows]
+
+
+# Функция для получения сводки по ролям
+async def role_stats() -> list[dict]:
+    await _ensure_schema()
+    rows = await local_storage.execute(
+        "SELECT NULL, role, games, wins, overdue, submit_seconds, submits FROM role_stats ORDER BY role"
+    )
+    return [_record(row) for row in rows]
@@ -0,0 +1,87 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+import leases
+import local_storage
+
+
+@pytest.fixture(autouse=True)
+def local_db(tmp_path, monkeypatch):
+    # Оба «воркера» работают с одним файлом БД, как процессы на одной машине
+    monkeypatch.setattr(local_storage, "LOCAL_DB_PATH", str(tmp_path / "state.sqlite3"))
+    monkeypatch.setattr(local_storage, "_writer", None)
+    monkeypatch.setattr(local_storage, "_readers", None)
+    monkeypatch.setattr(local_storage, "_write_lock", asyncio.Lock())
+    yield
+    if local_storage._writer is not None:
+        local_storage._writer.close()
+
+
+async def _workers(ttl: float = 30) -> tuple[leases.ShardLeases, leases.ShardLeases]:
+    first = leases.ShardLeases("first", shards=8, ttl=ttl)
+    second = leases.ShardLeases("second", shards=8, ttl=ttl)
+    await first.start()
+    await second.start()
+    return first, second
+
+
+def test_workers_split_shards():
+    async def scenario():
+        first, second = await _workers()
+        assert await first.renew() == set(range(8))
+        # Все шарды заняты: второй получит свою долю, когда первый отдаст лишние
+        assert await second.renew() == set()
+        await first.renew()
+        assert len(first.owned) == 4
+        assert await second.renew() == set(range(8)) - first.owned
+        assert all(first.owns(user_id) != second.owns(user_id) for user_id in range(8))
+
+    asyncio.run(scenario())
+
+
+def test_worker_takes_over_shards_of_stopped_worker():
+    async def scenario():
+        first, second = await _workers(ttl=0.5)
+        await first.renew()
+        await second.renew()
+        await first.renew()
+        await second.renew()
+        # Первый воркер «упал»: больше не продлевает аренду
+        await asyncio.sleep(0.6)
+        assert not any(first.owns(user_id) for user_id in range(8))
+        await second.renew()
+        assert second.owned == set(range(8))
+        assert all(second.owns(user_id) for user_id in range(8))
+
+    asyncio.run(scenario())
+
+
+def test_released_shards_are_taken_over_at_once():
+    async def scenario():
+        first, second = await _workers()
+        await first.renew()
+        assert await second.renew() == set()
+        await first.release()
+        assert await second.renew() == set(range(8))
+
+    asyncio.run(scenario())
+
+
+def test_failed_renew_drops_shards(monkeypatch):
+    async def scenario():
+        first, _ = await _workers()
+        await first.renew()
+        assert first.owns(1)
+
+        async def busy(now, expires):
+            raise sqlite3.OperationalError("database is locked")
+
+        monkeypatch.setattr(first, "_renew", busy)
+        with pytest.raises(sqlite3.OperationalError):
+            await first.renew()
+        assert not first.owns(1)
+        assert first.owned == set()
+
+    asyncio.run(scenario())
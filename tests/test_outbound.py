@@ -0,0 +1,80 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("aiogram")
+from aiogram.exceptions import TelegramRetryAfter
+
+from outbound import OutboundDispatcher
+
+
+class FakeBot:
+    """Бот без сети: запоминает отправленное, первые flood_limits вызовов отвечают RetryAfter"""
+
+    def __init__(self, flood_limits: int = 0, retry_after: float = 0.05) -> None:
+        self.sent: list[tuple[int, str]] = []
+        self.calls = 0
+        self.flood_limits = flood_limits
+        self.retry_after = retry_after
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        self.calls += 1
+        if self.calls <= self.flood_limits:
+            raise TelegramRetryAfter(
+                method=SimpleNamespace(chat_id=chat_id), message="Too Many Requests", retry_after=self.retry_after
+            )
+        await asyncio.sleep(0)
+        self.sent.append((chat_id, text))
+        return text
+
+
+def test_messages_of_one_chat_keep_their_order():
+    async def scenario():
+        bot = FakeBot()
+        outbound = OutboundDispatcher(bot, global_rate=1000, chat_interval=0)
+        for number in range(5):
+            for chat_id in (1, 2, 3):
+                outbound.send_message(chat_id, text=f"{chat_id}-{number}")
+        await outbound.join()
+        for chat_id in (1, 2, 3):
+            assert [text for chat, text in bot.sent if chat == chat_id] == [
+                f"{chat_id}-{number}" for number in range(5)
+            ]
+
+    asyncio.run(scenario())
+
+
+def test_retry_after_replays_the_same_message_in_order():
+    async def scenario():
+        bot = FakeBot(flood_limits=1)
+        outbound = OutboundDispatcher(bot, global_rate=1000, chat_interval=0)
+        first = outbound.send_message(1, text="first")
+        second = outbound.send_message(1, text="second")
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await outbound.join()
+        assert bot.sent == [(1, "first"), (1, "second")]
+        assert await first == "first"
+        assert await second == "second"
+        # Повтор был не раньше, чем просил Telegram
+        assert loop.time() - started >= bot.retry_after
+
+    asyncio.run(scenario())
+
+
+def test_retry_after_pauses_other_chats():
+    async def scenario():
+        bot = FakeBot(flood_limits=1, retry_after=0.1)
+        outbound = OutboundDispatcher(bot, global_rate=1000, chat_interval=0)
+        outbound.send_message(1, text="flooded")
+        await asyncio.sleep(0.01)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        sent = outbound.send_message(2, text="other chat")
+        await sent
+        assert loop.time() - started >= 0.05
+        await outbound.join()
+        assert sorted(bot.sent) == [(1, "flooded"), (2, "other chat")]
+
+    asyncio.run(scenario())
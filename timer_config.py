@@ -0,0 +1,73 @@
+import time
+
+import local_storage
+from database.timers_deadline import get_timer_value as db_get_timer_value
+
+# Как часто (секунды) сверяем версию настроек с другими воркерами
+VERSION_CHECK_INTERVAL = 5
+# Правка timer_values админом пока не вызывает changed(), поэтому значения
+# всё равно перечитываются из БД не реже чем раз в VALUE_TTL секунд
+VALUE_TTL = 60
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS config_version (
+    name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO config_version VALUES ('timer_values', 0);
+"""
+
+
+class TimerConfig:
+    """Кэш значений timer_values: сбрасывается по версии и перечитывается из БД по истечении VALUE_TTL"""
+
+    def __init__(self) -> None:
+        # name -> (время загрузки, значение)
+        self._values: dict[str, tuple[float, int]] = {}
+        self.version: int | None = None
+        self._checked_at = 0.0
+
+    # Функция для загрузки значений при старте бота
+    async def load(self, names: tuple[str, ...] = ("TZ", "Default")) -> None:
+        await local_storage.ensure_schema(_SCHEMA)
+        await self._check_version(force=True)
+        for name in names:
+            self._values[name] = (time.monotonic(), await db_get_timer_value(name))
+
+    async def get(self, name: str) -> int:
+        await self._check_version()
+        entry = self._values.get(name)
+        if entry is None or time.monotonic() - entry[0] >= VALUE_TTL:
+            entry = self._values[name] = (time.monotonic(), await db_get_timer_value(name))
+        return entry[1]
+
+    # Функция, которую нужно вызвать после изменения timer_values админом
+    async def changed(self) -> None:
+        await local_storage.ensure_schema(_SCHEMA)
+        await local_storage.execute(
+            "UPDATE config_version SET version = version + 1 WHERE name = 'timer_values'"
+        )
+        await self._check_version(force=True)
+
+    async def _check_version(self, force: bool = False) -> None:
+        now = time.monotonic()
+        if not force and now - self._checked_at < VERSION_CHECK_INTERVAL:
+            return
+        self._checked_at = now
+        if self.version is None:
+            await local_storage.ensure_schema(_SCHEMA)
+        rows = await local_storage.execute(
+            "SELECT version FROM config_version WHERE name = 'timer_values'"
+        )
+        version = rows[0][0] if rows else 0
+        if version != self.version:
+            self._values.clear()
+            self.version = version
+
+
+timer_config = TimerConfig()
+
+
+# Функция для получения значения таймера (в часах) из кэша
+async def get_timer_value(name: str) -> int:
+    return await timer_config.get(name)
@@ -0,0 +1,240 @@
+import asyncio
+import logging
+import sqlite3
+import time
+from collections import OrderedDict
+
+import database.commands as db
+from exporter import DB_PATH
+from game_journal import IN_GAME, ROLE_ASSIGNED, journal
+from leases import USE_LEASES
+from metrics import Gauge, register
+from player_pool import pool
+from records import GameParticipants, GameRecord, UserRecord
+
+# Размер кэша и время жизни записи (секунды)
+CACHE_SIZE = 10_000
+CACHE_TTL = 300
+# Как часто (секунды) пул свободных игроков перечитывается из БД: игры, завершённые
+# в обход change_in_game (решения судьи), иначе не возвращают игроков в пул
+POOL_REFRESH_INTERVAL = 300
+
+
+class UserCache:
+    """LRU/TTL кэш строк таблицы users с ручной инвалидацией на запись"""
+
+    def __init__(self, maxsize: int = CACHE_SIZE, ttl: float = CACHE_TTL) -> None:
+        self._maxsize = maxsize
+        self._ttl = ttl
+        # user_id -> (время загрузки, строка)
+        self._rows: OrderedDict = OrderedDict()
+        # user_id -> [число незавершённых чтений из БД, поколение]: поколение растёт
+        # при инвалидации, и прочитанная до неё строка в кэш не попадает
+        self._loading: dict[int, list[int]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    async def get(self, user_id: int):
+        entry = self._rows.get(user_id)
+        if entry is not None and time.monotonic() - entry[0] < self._ttl:
+            self._rows.move_to_end(user_id)
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        loading = self._loading.setdefault(user_id, [0, 0])
+        loading[0] += 1
+        generation = loading[1]
+        try:
+            user = await db.get_users_by_id(user_id)
+        finally:
+            loading[0] -= 1
+            if not loading[0]:
+                del self._loading[user_id]
+        if user is not None and loading[1] == generation:
+            self._rows[user_id] = (time.monotonic(), user)
+            self._rows.move_to_end(user_id)
+            if len(self._rows) > self._maxsize:
+                self._rows.popitem(last=False)
+        return user
+
+    def invalidate(self, *user_ids: int) -> None:
+        for user_id in user_ids:
+            self._rows.pop(user_id, None)
+            loading = self._loading.get(user_id)
+            if loading is not None:
+                loading[1] += 1
+
+    def clear(self) -> None:
+        self._rows.clear()
+        for loading in self._loading.values():
+            loading[1] += 1
+
+    def stats(self) -> dict:
+        return {"size": len(self._rows), "hits": self.hits, "misses": self.misses}
+
+
+users = UserCache()
+
+register(Gauge("bot_user_cache_hits_total", "Попадания в кэш пользователей", lambda: users.hits, "counter"))
+register(Gauge("bot_user_cache_misses_total", "Промахи кэша пользователей", lambda: users.misses, "counter"))
+register(Gauge("bot_user_cache_size", "Строк в кэше пользователей", lambda: len(users)))
+
+
+# Функция для получения пользователя через кэш
+async def get_users_by_id(user_id: int):
+    return await users.get(user_id)
+
+
+# Функция для получения нескольких пользователей сразу: из БД читаются только промахи кэша
+async def get_users_by_ids(user_ids) -> dict[int, UserRecord]:
+    unique = list(dict.fromkeys(user_id for user_id in user_ids if user_id))
+    rows = await asyncio.gather(*(users.get(user_id) for user_id in unique))
+    return {user_id: UserRecord.from_row(row) for user_id, row in zip(unique, rows) if row}
+
+
+# Функция для получения игры вместе с данными всех её участников
+async def get_game_with_participants(game_id: int, with_arguments: bool = False) -> GameParticipants | None:
+    if with_arguments:
+        row, arguments = await asyncio.gather(db.get_game_by_id(game_id), db.get_arg(game_id))
+    else:
+        row, arguments = await db.get_game_by_id(game_id), None
+    if row is None:
+        return None
+    game = GameRecord.from_row(row)
+    people = await get_users_by_ids((game.executor, game.inspector, game.judge, game.admin))
+    return GameParticipants(
+        game,
+        arguments,
+        people.get(game.executor),
+        people.get(game.inspector),
+        people.get(game.judge),
+        people.get(game.admin),
+    )
+
+
+# Функции записи: изменяют БД и сбрасывают кэш затронутых пользователей
+async def change_role(user_id: int, role: str):
+    result = await db.change_role(user_id, role)
+    users.invalidate(user_id)
+    pool.set_role(user_id, role)
+    return result
+
+
+async def change_in_game(user_id: int, in_game: int):
+    result = await db.change_in_game(user_id, in_game)
+    users.invalidate(user_id)
+    if in_game:
+        pool.occupy(user_id)
+    else:
+        pool.release(user_id)
+    journal.record(IN_GAME, user_id=user_id, value=in_game)
+    return result
+
+
+async def add_jud(user_id: int):
+    result = await db.add_jud(user_id)
+    users.invalidate(user_id)
+    return result
+
+
+async def add_ins(user_id: int):
+    result = await db.add_ins(user_id)
+    users.invalidate(user_id)
+    return result
+
+
+async def update_role_in_game(game_id: int, role: str, user_id: int):
+    result = await db.update_role_in_game(game_id, role, user_id)
+    users.invalidate(user_id)
+    journal.record(ROLE_ASSIGNED, game_id, user_id, role=role)
+    return result
+
+
+# Создание игры отмечает участников как занятых. Остальных участников выбирает БД,
+# поэтому их сбрасывает game_created, когда игра уже прочитана
+async def insert_new_game(user_id: int, **data):
+    result = await db.insert_new_game(user_id, **data)
+    users.invalidate(user_id)
+    return result
+
+
+# Функция для учёта участников созданной игры (строка games): сброс кэша и отметка в пуле
+def game_created(game) -> None:
+    users.invalidate(*game[1:5])
+    for user_id in game[1:5]:
+        pool.occupy(user_id)
+
+
+# Сколько id передаётся в одном IN (...): у SQLite есть предел числа параметров
+READ_CHUNK = 500
+
+
+def _read_users(db_path: str, user_ids: list[int]) -> dict[int, tuple]:
+    connection = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        key = connection.execute("PRAGMA table_info(users)").fetchone()[1]
+        users_by_id = {}
+        for start in range(0, len(user_ids), READ_CHUNK):
+            chunk = user_ids[start:start + READ_CHUNK]
+            rows = connection.execute(
+                f'SELECT * FROM users WHERE "{key}" IN ({",".join("?" * len(chunk))})', chunk
+            )
+            users_by_id.update((row[0], row) for row in rows)
+        return users_by_id
+    finally:
+        connection.close()
+
+
+# Функция для чтения нескольких пользователей одним запросом к БД, минуя кэш
+async def read_users(user_ids, db_path: str = DB_PATH) -> dict[int, tuple]:
+    return await asyncio.to_thread(_read_users, db_path, list(dict.fromkeys(user_ids)))
+
+
+def _read_players(db_path: str) -> list[tuple[int, str, bool, int]]:
+    connection = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        try:
+            overdue = dict(connection.execute("SELECT * FROM overdue_count").fetchall())
+        except sqlite3.OperationalError:
+            overdue = {}
+        return [
+            (user[0], user[6], not user[10], overdue.get(user[0], 0))
+            for user in connection.execute("SELECT * FROM users")
+        ]
+    finally:
+        connection.close()
+
+
+# Функция для загрузки всех игроков в пул при старте: выбор идёт из всех свободных
+async def load_pool(db_path: str = DB_PATH) -> None:
+    if USE_LEASES:
+        return
+    try:
+        pool.load(await asyncio.to_thread(_read_players, db_path))
+    except Exception as e:
+        # Без пула find_free_user выбирает игроков через БД
+        logging.error(f"Error in load_pool: {e}")
+
+
+# Функция для периодического обновления пула из БД (в фоне)
+async def maintain_pool(interval: float = POOL_REFRESH_INTERVAL) -> None:
+    while not USE_LEASES:
+        await asyncio.sleep(interval)
+        await load_pool()
+
+
+# Функция для поиска свободного игрока: сначала пул в памяти, затем БД
+async def find_free_user(role: str):
+    # Пул свой у каждого процесса: при нескольких воркерах выбирает только БД
+    while not USE_LEASES and (user_id := pool.pick(role)) is not None:
+        # Пул мог устареть (игрока занял другой процесс), поэтому проверяем по БД, не по кэшу
+        user = await db.get_users_by_id(user_id)
+        if user and user[6] == role and not user[10]:
+            return user_id
+    user_id = await db.find_free_user(role)
+    if user_id:
+        pool.occupy(user_id, role)
+    return user_id
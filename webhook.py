@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import os
+import time
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aiohttp import web
+
+from keyed_locks import KeyedLocks
+from metrics import Histogram, register
+
+WEBHOOK_HOST = "127.0.0.1"
+WEBHOOK_PORT = 8080
+WEBHOOK_PATH = "/webhook"
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+# Сколько обновлений обрабатывается одновременно
+UPDATE_CONCURRENCY = 64
+
+update_ingest_latency = register(
+    Histogram("bot_update_ingest_seconds", "Время от получения обновления до запуска обработчика")
+)
+
+
+def _chat_id(update: Update) -> int | None:
+    try:
+        event = update.event
+    except Exception:
+        # Неизвестный тип обновления: обрабатываем без упорядочивания
+        return None
+    chat = getattr(event, "chat", None) or getattr(getattr(event, "message", None), "chat", None)
+    if chat is not None:
+        return chat.id
+    user = getattr(event, "from_user", None)
+    return user.id if user is not None else None
+
+
+class WebhookIngestor:
+    """Приём обновлений через вебхук: разные чаты параллельно, один чат строго по порядку.
+
+    Проверить локально можно, отправив сохранённое обновление:
+        curl -X POST localhost:8080/webhook -H "Content-Type: application/json" -d @update.json
+    """
+
+    def __init__(self, bot: Bot, dp: Dispatcher, concurrency: int = UPDATE_CONCURRENCY) -> None:
+        self._bot = bot
+        self._dp = dp
+        # Слот занимается при приёме запроса: при перегрузке Telegram подождёт ответа
+        self._slots = asyncio.Semaphore(concurrency)
+        self._chat_locks = KeyedLocks()
+        self._tasks: set[asyncio.Task] = set()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+            return web.Response(status=401)
+        received = time.perf_counter()
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self._bot})
+        except Exception as e:
+            logging.error(f"Error in webhook handle: {e}")
+            return web.Response(status=400)
+        await self._slots.acquire()
+        # Задачи стартуют в порядке приёма, а блокировка чата выдаётся по очереди
+        task = asyncio.create_task(self._process(update, received))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def _process(self, update: Update, received: float) -> None:
+        try:
+            chat_id = _chat_id(update)
+            if chat_id is None:
+                update_ingest_latency.observe(time.perf_counter() - received)
+                await self._dp.feed_update(self._bot, update)
+                return
+            async with self._chat_locks(chat_id):
+                update_ingest_latency.observe(time.perf_counter() - received)
+                await self._dp.feed_update(self._bot, update)
+        except Exception as e:
+            logging.error(f"Error in webhook _process: {e}")
+        finally:
+            self._slots.release()
+
+    # Функция ожидания обработки всех принятых обновлений
+    async def join(self) -> None:
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+# Функция для запуска приёма обновлений через вебхук на встроенном HTTP-сервере
+async def start_webhook(
+    bot: Bot,
+    dp: Dispatcher,
+    url: str | None = None,
+    host: str = WEBHOOK_HOST,
+    port: int = WEBHOOK_PORT,
+    path: str = WEBHOOK_PATH,
+    concurrency: int = UPDATE_CONCURRENCY,
+) -> web.AppRunner:
+    ingestor = WebhookIngestor(bot, dp, concurrency)
+    app = web.Application()
+    app.router.add_post(path, ingestor.handle)
+
+    async def on_shutdown(_: web.Application) -> None:
+        await ingestor.join()
+
+    app.on_shutdown.append(on_shutdown)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    # Без url сервер только слушает локально (например, для прогона записанных обновлений)
+    if url:
+        await bot.set_webhook(
+            f"{url.rstrip('/')}{path}",
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+    return runner